@@ -0,0 +1,418 @@
+"""
+Asyncio IMAP client.
+- Minimal IMAP4rev1 subset used by the bounce processor (login, select,
+  search, fetch, copy, store, expunge, status, noop, logout).
+- Command pipelining: several tagged commands may be in flight at once,
+  a single reader task routes responses back to their commands.
+- Literals are read in chunks into buffers, or streamed into a
+  caller-supplied sink (FETCH with sink=...). A buffered literal over
+  max_literal is read off the wire and discarded; only the command it
+  answers fails, the connection stays usable.
+- Timeouts count server inactivity, so commands queued behind a long
+  literal do not expire while it is still arriving.
+- SSL and STARTTLS, mirroring the IMAP_SECURE options of imaplib.
+- Results use the same (typ, data) shape as imaplib.
+"""
+
+import re
+import ssl
+import asyncio
+
+CRLF = b"\r\n"
+
+# Literal reads are chunked; a buffered literal may not exceed MAX_LITERAL
+CHUNK_SIZE = 64 * 1024
+MAX_LITERAL = 64 * 1024 * 1024
+# StreamReader line limit (long SEARCH results come back on one line)
+LINE_LIMIT = 1024 * 1024
+
+LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+TAGGED_RE = re.compile(rb"^(?P<tag>[A-Z]\d+) (?P<typ>[A-Z]+) ?(?P<text>.*)$")
+UNTAGGED_RE = re.compile(rb"^\* (?:(?P<num>\d+) )?(?P<typ>[A-Z]+) ?(?P<data>.*)$", re.S)
+
+
+class IMAPError(Exception):
+    """Protocol error, BAD response or failed login"""
+
+
+class LiteralTooLarge(IMAPError):
+    """A FETCH literal exceeded max_literal and was discarded"""
+
+
+class LiteralBuffer:
+    """Accumulates literal chunks"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, chunk):
+        self.data += chunk
+
+    def getvalue(self):
+        return bytes(self.data)
+
+
+class Response:
+    """One untagged response: its type, message number and raw pieces"""
+
+    def __init__(self, typ, num, pieces):
+        self.typ = typ
+        self.num = num
+        self.pieces = pieces  # alternating text lines and literal values
+
+    def as_imaplib(self):
+        """Convert to the items imaplib puts in its data lists"""
+        if len(self.pieces) == 1:
+            return [self.pieces[0]]
+        items = []
+        pieces = list(self.pieces)
+        while len(pieces) > 1:
+            items.append((pieces.pop(0), pieces.pop(0)))
+        if pieces:
+            items.append(pieces[0])
+        return items
+
+
+class _Command:
+    def __init__(self, tag, name, expect=None, num=None, sink=None):
+        self.tag = tag
+        self.name = name
+        self.expect = expect  # untagged type this command collects
+        self.num = num        # message number (FETCH routing)
+        self.sink = sink      # receives FETCH literal chunks via write()
+        self.responses = []
+        self.error = None     # raised instead of returning data
+        self.future = asyncio.get_running_loop().create_future()
+
+    def wants(self, response):
+        if self.expect is None or response.typ != self.expect:
+            return False
+        return self.num is None or response.num == self.num
+
+
+class AsyncIMAP4:
+    """Asyncio IMAP connection with pipelined commands"""
+
+    def __init__(self, host, port, secure="none", timeout=60,
+                 chunk_size=CHUNK_SIZE, max_literal=MAX_LITERAL, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.ssl_context = ssl_context  # as imaplib's ssl_context; default verifies
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.max_literal = max_literal
+        self.reader = None
+        self.writer = None
+        self.state = "LOGOUT"
+        self._tag_counter = 0
+        self._pending = []
+        self._reader_task = None
+        self._write_lock = asyncio.Lock()
+        self._last_activity = 0.0  # loop time of the last read or write
+
+    # ----------------------------------------
+    # Connection
+    # ----------------------------------------
+
+    async def connect(self):
+        ctx = None
+        if self.secure in ("ssl", "starttls"):
+            ctx = self.ssl_context or ssl.create_default_context()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port,
+                ssl=ctx if self.secure == "ssl" else None,
+                limit=LINE_LIMIT,
+            ),
+            self.timeout,
+        )
+
+        greeting = await self._read_line()
+        if not greeting.startswith(b"* OK") and not greeting.startswith(b"* PREAUTH"):
+            raise IMAPError(f"Unexpected greeting: {greeting!r}")
+        self.state = "NONAUTH"
+
+        if self.secure == "starttls":
+            await self._starttls(ctx)
+
+        self._reader_task = asyncio.create_task(self._read_loop())
+        return self
+
+    async def _starttls(self, ctx):
+        # Runs before the reader task exists: nothing may be in flight
+        tag = self._next_tag()
+        self.writer.write(tag + b" STARTTLS" + CRLF)
+        await self.writer.drain()
+        while True:
+            line = await self._read_line()
+            match = TAGGED_RE.match(line)
+            if match and match.group("tag") == tag:
+                if match.group("typ") != b"OK":
+                    raise IMAPError(f"STARTTLS failed: {line!r}")
+                break
+        await self.writer.start_tls(ctx, server_hostname=self.host)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.state = "LOGOUT"
+
+    # ----------------------------------------
+    # Wire helpers
+    # ----------------------------------------
+
+    def _next_tag(self):
+        self._tag_counter += 1
+        return b"A%04d" % self._tag_counter
+
+    def _touch(self):
+        self._last_activity = asyncio.get_running_loop().time()
+
+    async def _read_line(self):
+        line = await self.reader.readuntil(CRLF)
+        self._touch()
+        return line[:-2]
+
+    async def _read_literal(self, size, sink=None):
+        """Read a literal in chunks into a buffer or the given sink.
+
+        A buffered literal over max_literal is drained and replaced by
+        a LiteralTooLarge error, which fails the command it answers.
+        """
+        if sink is None and size > self.max_literal:
+            buffer = None
+        else:
+            buffer = sink if sink is not None else LiteralBuffer()
+        remaining = size
+        while remaining:
+            chunk = await self.reader.read(min(self.chunk_size, remaining))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            self._touch()
+            if buffer is not None:
+                buffer.write(chunk)
+            remaining -= len(chunk)
+        if buffer is None:
+            return LiteralTooLarge(f"Literal of {size} bytes exceeds limit of {self.max_literal}")
+        return buffer if sink is not None else buffer.getvalue()
+
+    def _sink_for(self, line):
+        """Sink of the in-flight FETCH this untagged line answers, if any"""
+        match = UNTAGGED_RE.match(line)
+        if not match or match.group("typ") != b"FETCH" or not match.group("num"):
+            return None
+        num = int(match.group("num"))
+        for command in self._pending:
+            if command.sink is not None and command.num == num:
+                return command.sink
+        return None
+
+    async def _read_response(self):
+        """Read one complete server response, including any literals"""
+        line = await self._read_line()
+        sink = self._sink_for(line)
+        pieces = []
+        while True:
+            match = LITERAL_RE.search(line)
+            if not match:
+                pieces.append(line)
+                return pieces
+            pieces.append(line)
+            pieces.append(await self._read_literal(int(match.group(1)), sink))
+            # Only the first literal (the message body) goes to the sink
+            sink = None
+            line = await self._read_line()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                pieces = await self._read_response()
+                self._dispatch(pieces)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e if isinstance(e, IMAPError) else IMAPError(f"Connection lost: {e}")
+            for command in self._pending:
+                if not command.future.done():
+                    command.future.set_exception(error)
+            self._pending = []
+
+    def _dispatch(self, pieces):
+        first = pieces[0]
+
+        if first.startswith(b"* "):
+            match = UNTAGGED_RE.match(first)
+            if not match:
+                return
+            num = int(match.group("num")) if match.group("num") else None
+            data = match.group("data")
+            if num is not None:
+                data = match.group("num") + (b" " + data if data else b"")
+            response = Response(match.group("typ").decode(), num, [data] + pieces[1:])
+            # Route to the first in-flight command that asked for it,
+            # otherwise to the oldest one (SELECT's EXISTS etc.). A FETCH
+            # reply for a number nobody asked about (unsolicited flag
+            # updates) is dropped rather than mixed into another command.
+            for command in self._pending:
+                if command.wants(response):
+                    break
+            else:
+                if not self._pending or response.typ == "FETCH":
+                    return
+                command = self._pending[0]
+            command.responses.append(response)
+            for piece in pieces:
+                if isinstance(piece, LiteralTooLarge):
+                    command.error = piece
+            return
+
+        if first.startswith(b"+"):
+            return
+
+        match = TAGGED_RE.match(first)
+        if not match:
+            return
+        tag = match.group("tag")
+        for command in self._pending:
+            if command.tag == tag:
+                self._pending.remove(command)
+                if not command.future.done():
+                    command.future.set_result((match.group("typ").decode(), match.group("text")))
+                return
+
+    # ----------------------------------------
+    # Commands
+    # ----------------------------------------
+
+    async def _command(self, name, *args, expect=None, num=None, sink=None):
+        """Send a tagged command and wait for its completion.
+
+        Commands are written immediately; awaiting several of these
+        concurrently pipelines them on the connection.
+        """
+        if self._reader_task is None or self._reader_task.done():
+            raise IMAPError("Not connected")
+
+        async with self._write_lock:
+            command = _Command(self._next_tag(), name, expect=expect, num=num, sink=sink)
+            self._pending.append(command)
+            line = b" ".join([command.tag, name.encode()] + [_encode(a) for a in args])
+            self.writer.write(line + CRLF)
+            await self.writer.drain()
+            self._touch()
+
+        typ, text = await self._wait(command)
+        if command.error is not None:
+            raise command.error
+        if typ == "BAD":
+            raise IMAPError(f"{name} command error: {text.decode(errors='replace')}")
+
+        if expect:
+            data = [item for r in command.responses
+                    if r.typ == expect and (num is None or r.num == num)
+                    for item in r.as_imaplib()]
+            return typ, data or [None]
+        return typ, [text]
+
+    async def _wait(self, command):
+        """Wait for a command's tagged reply.
+
+        Times out only after `timeout` seconds in which nothing was read
+        or written; replies to earlier pipelined commands keep it alive.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                idle = loop.time() - self._last_activity
+                if idle >= self.timeout:
+                    raise IMAPError(f"{command.name} timed out after {self.timeout}s without server activity")
+                done, _ = await asyncio.wait([command.future], timeout=self.timeout - idle)
+                if done:
+                    return command.future.result()
+        finally:
+            # Abandoned (timed out or cancelled): a late reply is ignored
+            command.future.cancel()
+
+    async def login(self, user, password):
+        typ, data = await self._command("LOGIN", _quote(user), _quote(password))
+        if typ != "OK":
+            raise IMAPError(data[-1].decode(errors="replace"))
+        self.state = "AUTH"
+        return typ, data
+
+    async def select(self, mailbox="INBOX"):
+        typ, data = await self._command("SELECT", _quote(mailbox), expect="EXISTS")
+        if typ == "OK":
+            self.state = "SELECTED"
+        return typ, data
+
+    async def search(self, charset, *criteria):
+        args = (["CHARSET", charset] if charset else []) + list(criteria)
+        typ, data = await self._command("SEARCH", *args, expect="SEARCH")
+        # imaplib returns b"" rather than None for an empty result
+        return typ, [d if d is not None else b"" for d in data]
+
+    async def fetch(self, message_set, message_parts, sink=None):
+        """FETCH; with a sink, the literal of a single-message fetch is
+        streamed into sink.write() and the sink takes its place in data."""
+        message_set = _text(message_set)
+        num = int(message_set) if message_set.isdigit() else None
+        if sink is not None and num is None:
+            raise ValueError("sink requires a single message number")
+        return await self._command("FETCH", message_set, message_parts,
+                                   expect="FETCH", num=num, sink=sink)
+
+    async def copy(self, message_set, new_mailbox):
+        return await self._command("COPY", _text(message_set), _quote(new_mailbox))
+
+    async def store(self, message_set, command, flags):
+        """STORE; the FETCH (FLAGS ...) replies are returned like imaplib
+        (none with +FLAGS.SILENT)."""
+        message_set = _text(message_set)
+        num = int(message_set) if message_set.isdigit() else None
+        if not flags.startswith("("):
+            flags = f"({flags})"
+        return await self._command("STORE", message_set, command, flags, expect="FETCH", num=num)
+
+    async def status(self, mailbox, names):
+        return await self._command("STATUS", _quote(mailbox), names, expect="STATUS")
+
+    async def expunge(self):
+        return await self._command("EXPUNGE", expect="EXPUNGE")
+
+    async def noop(self):
+        return await self._command("NOOP")
+
+    async def logout(self):
+        try:
+            typ, data = await self._command("LOGOUT", expect="BYE")
+        except IMAPError:
+            typ, data = "BYE", [None]
+        await self.close()
+        return typ, data
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _encode(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def _quote(value):
+    """Quote an astring argument"""
+    value = _text(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{value}"'
@@ -0,0 +1,100 @@
+"""
+Benchmark message parsing memory.
+Builds a bounce returning an original message with a large attachment and
+reports time and peak RSS for each parse mode, each in a fresh interpreter:
+- full   : email.message_from_bytes on the fetched bytes (old behaviour)
+- stream : BoundedMessageParser over the fetched bytes (imaplib engine)
+- wire   : chunks fed straight into BoundedMessageParser, the raw message
+           is never held in memory (asyncio engine)
+
+Usage: python bench_parse.py [--size-mb 30]
+"""
+
+import sys
+import time
+import base64
+import resource
+import argparse
+import subprocess
+
+from message_parser import BoundedMessageParser, parse_message
+
+MESSAGE_MAX_BYTES = 10 * 1024 * 1024
+PART_MAX_BYTES = 1024 * 1024
+
+HEAD = (
+    b"From: MAILER-DAEMON@mx.example.com\r\n"
+    b"To: sender@example.com\r\n"
+    b"Subject: Undelivered Mail Returned to Sender\r\n"
+    b'Content-Type: multipart/report; report-type=delivery-status; boundary="outer"\r\n'
+    b"\r\n"
+    b"--outer\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"\r\n"
+    b"550 5.1.1 <user@nowhere.com>: Recipient address rejected\r\n"
+    b"--outer\r\n"
+    b"Content-Type: message/rfc822\r\n"
+    b"\r\n"
+    b"Message-ID: <original@example.com>\r\n"
+    b'Content-Type: multipart/mixed; boundary="inner"\r\n'
+    b"\r\n"
+    b"--inner\r\n"
+    b"Content-Type: application/octet-stream\r\n"
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"\r\n"
+)
+TAIL = b"--inner--\r\n--outer--\r\n"
+
+
+def bounce_chunks(size_mb):
+    """Yield the message in 64 KiB-ish chunks without materializing it"""
+    yield HEAD
+    block = base64.encodebytes(b"\xa5" * 48 * 1024)  # 64 KiB of base64 lines
+    for _ in range(size_mb * 1024 * 1024 // len(block) + 1):
+        yield block
+    yield TAIL
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode, size_mb):
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    truncated = 0
+    if mode == "wire":
+        parser = BoundedMessageParser(MESSAGE_MAX_BYTES, PART_MAX_BYTES)
+        for chunk in bounce_chunks(size_mb):
+            parser.write(chunk)
+        msg = parser.close()
+        truncated = parser.truncated_bytes
+    else:
+        raw = b"".join(bounce_chunks(size_mb))
+        msg, truncated = parse_message(raw, mode, MESSAGE_MAX_BYTES, PART_MAX_BYTES)
+        del raw
+    elapsed = time.perf_counter() - start
+    assert msg.get_content_type() == "multipart/report"
+    print(f"{mode:<7} {elapsed:>8.3f}s {peak_rss_mb():>10.1f} MB {peak_rss_mb() - baseline:>10.1f} MB "
+          f"{truncated / 1024 / 1024:>10.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=30)
+    parser.add_argument("--mode", choices=["full", "stream", "wire"])
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.size_mb)
+        return
+
+    print(f"Attachment size: {args.size_mb} MB, "
+          f"MESSAGE_MAX_BYTES={MESSAGE_MAX_BYTES}, PART_MAX_BYTES={PART_MAX_BYTES}")
+    print(f"{'mode':<7} {'time':>9} {'peak RSS':>13} {'parse RSS':>13} {'discarded':>13}")
+    for mode in ("full", "stream", "wire"):
+        subprocess.run([sys.executable, __file__, "--mode", mode, "--size-mb", str(args.size_mb)], check=True)
+
+
+if __name__ == "__main__":
+    main()
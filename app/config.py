@@ -0,0 +1,121 @@
+"""
+Configuration loading.
+Kept free of heavy imports so one-off entry points (dispatch.py) can read the config
+before deciding whether there is any work to do.
+"""
+
+import os
+from dotenv import load_dotenv
+
+ENV_FILE = "data/.env"
+
+# Per-account keys; each can be overridden with IMAP_<ACCOUNT>_<SUFFIX>
+ACCOUNT_KEYS = [
+    "IMAP_SERVER", "IMAP_PORT", "IMAP_USER", "IMAP_PASS", "IMAP_SECURE",
+    "IMAP_FOLDER_INBOX", "IMAP_FOLDER_PROCESSED",
+    "IMAP_FOLDER_PROBLEM", "IMAP_FOLDER_SKIPPED",
+    "IMAP_FOLDER_TEST", "IMAP_FOLDER_TESTPROCESSED",
+    "IMAP_FOLDER_TESTPROBLEM", "IMAP_FOLDER_TESTSKIPPED",
+]
+
+
+def load_config():
+    """Reload config from .env each run (supports real-time toggle)"""
+    load_dotenv(ENV_FILE, override=True)
+
+    config = {
+        # IMAP
+        "IMAP_SERVER": os.getenv("IMAP_SERVER"),
+        "IMAP_PORT": int(os.getenv("IMAP_PORT", "143")),
+        "IMAP_USER": os.getenv("IMAP_USER"),
+        "IMAP_PASS": os.getenv("IMAP_PASS"),
+        "IMAP_SECURE": os.getenv("IMAP_SECURE", "none").lower(),
+
+        # IMAP Folders (normal)
+        "IMAP_FOLDER_INBOX": os.getenv("IMAP_FOLDER_INBOX", "INBOX"),
+        "IMAP_FOLDER_PROCESSED": os.getenv("IMAP_FOLDER_PROCESSED", "PROCESSED"),
+        "IMAP_FOLDER_PROBLEM": os.getenv("IMAP_FOLDER_PROBLEM", "PROBLEM"),
+        "IMAP_FOLDER_SKIPPED": os.getenv("IMAP_FOLDER_SKIPPED", "SKIPPED"),
+
+        # IMAP Folders (test mode)
+        "IMAP_FOLDER_TEST": os.getenv("IMAP_FOLDER_TEST", "TEST"),
+        "IMAP_FOLDER_TESTPROCESSED": os.getenv("IMAP_FOLDER_TESTPROCESSED", "TESTPROCESSED"),
+        "IMAP_FOLDER_TESTPROBLEM": os.getenv("IMAP_FOLDER_TESTPROBLEM", "TESTPROBLEM"),
+        "IMAP_FOLDER_TESTSKIPPED": os.getenv("IMAP_FOLDER_TESTSKIPPED", "TESTSKIPPED"),
+
+        # Flags
+        "IMAP_TEST_MODE": os.getenv("IMAP_TEST_MODE", "false").lower() == "true",
+
+        # SMTP
+        "SMTP_SERVER": os.getenv("SMTP_SERVER", "localhost"),
+        "SMTP_PORT": int(os.getenv("SMTP_PORT", "25")),
+        "SMTP_USER": os.getenv("SMTP_USER", ""),
+        "SMTP_PASS": os.getenv("SMTP_PASS", ""),
+
+        # Notifications
+        "NOTIFY_CC": [e.strip() for e in os.getenv("NOTIFY_CC", "").split(",") if e.strip()],
+        "NOTIFY_CC_TEST": [e.strip() for e in os.getenv("NOTIFY_CC_TEST", "").split(",") if e.strip()],
+
+        # Org info
+        "ORG_NAME": os.getenv("ORG_NAME", "Support Team"),
+        "ORG_EMAIL": os.getenv("ORG_EMAIL", "support@example.com"),
+        "ORG_LOGO_URL": os.getenv("ORG_LOGO_URL", ""),
+
+        # Concurrency
+        "IMAP_MAX_WORKERS": int(os.getenv("IMAP_MAX_WORKERS", "4")),
+        "IMAP_MAX_CONNECTIONS": int(os.getenv("IMAP_MAX_CONNECTIONS", "2")),
+
+        # IMAP engine: imaplib (blocking, threads) | asyncio (pipelined)
+        "IMAP_ENGINE": os.getenv("IMAP_ENGINE", "imaplib").lower(),
+        "IMAP_PIPELINE_DEPTH": int(os.getenv("IMAP_PIPELINE_DEPTH", "8")),
+
+        # Message parsing: stream (memory-bounded) | full
+        "PARSE_MODE": os.getenv("PARSE_MODE", "stream").lower(),
+        "MESSAGE_MAX_BYTES": int(os.getenv("MESSAGE_MAX_BYTES", str(10 * 1024 * 1024))),
+        "PART_MAX_BYTES": int(os.getenv("PART_MAX_BYTES", str(1024 * 1024))),
+
+        # Duplicate DSN suppression window (0 disables)
+        "DEDUP_TTL_HOURS": float(os.getenv("DEDUP_TTL_HOURS", "72")),
+
+        # Scheduler (scheduler.py)
+        "SCHEDULER_ENABLED": os.getenv("SCHEDULER_ENABLED", "true").lower() == "true",
+        "SCHEDULE_BOUNCES_SECONDS": int(os.getenv("SCHEDULE_BOUNCES_SECONDS", "300")),
+        "SCHEDULE_RETRY_SECONDS": int(os.getenv("SCHEDULE_RETRY_SECONDS", "1800")),
+        "SCHEDULE_SUMMARY_AT": os.getenv("SCHEDULE_SUMMARY_AT", "00:00"),
+        "SCHEDULER_JITTER_SECONDS": int(os.getenv("SCHEDULER_JITTER_SECONDS", "15")),
+        "SCHEDULE_RETENTION_AT": os.getenv("SCHEDULE_RETENTION_AT", "03:00"),
+
+        # Retention (retention.py); RETENTION_DAYS=0 keeps everything live
+        "RETENTION_DAYS": int(os.getenv("RETENTION_DAYS", "0")),
+        "ARCHIVE_DIR": os.getenv("ARCHIVE_DIR", os.path.join(
+            os.path.dirname(os.getenv("DB_PATH", "/data/bounces.db")) or ".", "archive")),
+        "ARCHIVE_FORMAT": os.getenv("ARCHIVE_FORMAT", "sqlite").lower(),  # sqlite | ndjson
+        "RETENTION_VACUUM_PAGES": int(os.getenv("RETENTION_VACUUM_PAGES", "0")),
+    }
+    config["IMAP_ACCOUNTS"] = load_accounts(config)
+    return config
+
+
+def load_accounts(config):
+    """Build the list of mailboxes to process.
+
+    IMAP_ACCOUNTS is a comma-separated list of account names. Each account
+    inherits the global IMAP_* settings and may override any of them with
+    IMAP_<NAME>_<SUFFIX>, e.g. IMAP_BILLING_USER or IMAP_BILLING_FOLDER_INBOX.
+    Without IMAP_ACCOUNTS a single "default" account is used.
+    """
+    names = [n.strip() for n in os.getenv("IMAP_ACCOUNTS", "").split(",") if n.strip()]
+    if not names:
+        return [dict({"NAME": "default"}, **{key: config[key] for key in ACCOUNT_KEYS})]
+
+    accounts = []
+    for name in names:
+        prefix = f"IMAP_{name.upper()}_"
+        account = {"NAME": name}
+        for key in ACCOUNT_KEYS:
+            value = os.getenv(prefix + key[len("IMAP_"):])
+            account[key] = config[key] if value is None else value
+        account["IMAP_PORT"] = int(account["IMAP_PORT"])
+        account["IMAP_SECURE"] = account["IMAP_SECURE"].lower()
+        accounts.append(account)
+    return accounts
@@ -0,0 +1,13 @@
+import pytest
+
+import db
+
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """Fresh bounces database under tmp_path for the duration of a test"""
+    path = str(tmp_path / "bounces.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    monkeypatch.setattr(db, "_schema_ready", False)
+    db.init_db()
+    return path
@@ -1,21 +1,18 @@
 # daily_summary.py
-import os, sqlite3, smtplib
+import sqlite3, smtplib
 from email.message import EmailMessage
-from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from config import load_config
 
-load_dotenv()
 DB_PATH = "/data/bounces.db"
 
-SMTP_SERVER = os.getenv("SMTP_SERVER", "localhost")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+def send_summary(config=None, connections=None):
+    """Send daily summary of bounces in the last 24 hours.
 
-NOTIFY_CC = [x.strip() for x in os.getenv("NOTIFY_CC", "").split(",") if x.strip()]
-NOTIFY_CC_TEST = [x.strip() for x in os.getenv("NOTIFY_CC_TEST", "").split(",") if x.strip()]
-IMAP_TEST_MODE = os.getenv("IMAP_TEST_MODE", "false").lower() == "true"
-
-def send_summary():
-    """Send daily summary of bounces in the last 24 hours."""
+    config is read from .env on every call unless given, so test mode and
+    SMTP changes apply to the next summary without a restart.
+    """
+    config = config or load_config()
     con = sqlite3.connect(DB_PATH)
     con.row_factory = sqlite3.Row
     cur = con.cursor()
@@ -33,10 +30,10 @@ def send_summary():
     con.close()
 
     # Decide recipients
-    if IMAP_TEST_MODE:
-        notify_recipients = NOTIFY_CC_TEST
+    if config["IMAP_TEST_MODE"]:
+        notify_recipients = config["NOTIFY_CC_TEST"]
     else:
-        notify_recipients = NOTIFY_CC
+        notify_recipients = config["NOTIFY_CC"]
 
     if not notify_recipients:
         print("No recipients defined for daily summary.")
@@ -67,8 +64,12 @@ def send_summary():
     msg["To"] = ", ".join(notify_recipients)
     msg.set_content(body)
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as s:
-        s.send_message(msg)
+    if connections is not None:
+        connections.sendmail(config["SMTP_SERVER"], config["SMTP_PORT"], "", "",
+                             msg["From"], notify_recipients, msg.as_string())
+    else:
+        with smtplib.SMTP(config["SMTP_SERVER"], config["SMTP_PORT"]) as s:
+            s.send_message(msg)
 
     print(f"Daily summary sent to: {', '.join(notify_recipients)}")
 
@@ -4,9 +4,17 @@ import sqlite3
 # Always store DB in /data (persisted via docker-compose bind mount)
 DB_PATH = os.getenv("DB_PATH", "/data/bounces.db")
 
+# Set once init_db() has run in this process (long-lived scheduler/web UI)
+_schema_ready = False
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Column order used by exports and archives
+BOUNCE_COLUMNS = ["id", "date", "email_to", "email_cc", "status", "reason",
+                  "domain", "notified_to", "notified_cc", "account"]
+
+
+def get_connection(check_same_thread=True):
+    # Generous timeout: several account workers may write concurrently
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -37,66 +45,246 @@ def init_db():
         cur.execute("ALTER TABLE bounces ADD COLUMN notified_to TEXT")
     if "notified_cc" not in existing_cols:
         cur.execute("ALTER TABLE bounces ADD COLUMN notified_cc TEXT")
+    if "account" not in existing_cols:
+        cur.execute("ALTER TABLE bounces ADD COLUMN account TEXT")
+
+    # Date-range queries (daily summary, retention) use this index
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bounces_date ON bounces(date)")
+
+    # Per-month counts of rows moved to the archive (see retention.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bounce_rollups (
+            month TEXT,
+            status TEXT,
+            domain TEXT,
+            account TEXT,
+            count INTEGER,
+            PRIMARY KEY (month, status, domain, account)
+        )
+    """)
+
+    # Recently seen duplicate-bounce fingerprints (see dedup.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bounce_fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            seen REAL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bounce_fingerprints_seen ON bounce_fingerprints(seen)")
 
     conn.commit()
     conn.close()
 
+    global _schema_ready
+    _schema_ready = True
+
+
+def ensure_db():
+    """Run init_db() once per process"""
+    if not _schema_ready:
+        init_db()
+
 
 def insert_bounce(email_to, email_cc, status, reason, domain,
-                  notified_to="", notified_cc=""):
-    init_db()  # Safety: ensure table exists before inserting
-    conn = get_connection()
+                  notified_to="", notified_cc="", account="", conn=None):
+    """Insert one bounce row; with conn, inside the caller's transaction"""
+    ensure_db()  # Safety: ensure table exists before inserting
+    own = conn is None
+    conn = conn or get_connection()
     cur = conn.cursor()
     cur.execute(
         """INSERT INTO bounces 
-           (email_to, email_cc, status, reason, domain, notified_to, notified_cc) 
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (email_to, email_cc, status, reason, domain, notified_to, notified_cc),
+           (email_to, email_cc, status, reason, domain, notified_to, notified_cc, account) 
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (email_to, email_cc, status, reason, domain, notified_to, notified_cc, account),
     )
-    conn.commit()
-    conn.close()
+    if own:
+        conn.commit()
+        conn.close()
 
 
-def query_bounces(filters=None):
-    init_db()  # Safety: ensure table exists before querying
-    filters = filters or {}
-    query = "SELECT * FROM bounces WHERE 1=1"
+def filter_clause(filters, dates=True):
+    """SQL conditions and params for the supported bounce filters.
+
+    Filters: status, domain, account and (when dates=True) date_from /
+    date_to, given as "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS" (UTC).
+    """
+    clause = ""
     params = []
+    for column in ("status", "domain", "account"):
+        if column in filters:
+            clause += f" AND {column}=?"
+            params.append(filters[column])
+    if dates and filters.get("date_from"):
+        clause += " AND date >= ?"
+        params.append(filters["date_from"])
+    if dates and filters.get("date_to"):
+        # A bare date includes that whole day
+        clause += " AND date <= ?"
+        params.append(end_of_day(filters["date_to"]))
+    return clause, params
 
-    if "status" in filters:
-        query += " AND status=?"
-        params.append(filters["status"])
-    if "domain" in filters:
-        query += " AND domain=?"
-        params.append(filters["domain"])
+
+def end_of_day(value):
+    return value + " 23:59:59" if len(value) == 10 else value
+
+
+def reads_archive(filters):
+    """Date-filtered reads include archived months; others use the live table
+    (and bounce_rollups for counts)"""
+    return bool(filters.get("date_from") or filters.get("date_to"))
+
+
+def query_bounces(filters=None):
+    """Bounce rows matching filters.
+
+    Archived rows are included only for date-filtered queries (see
+    reads_archive), and only from the months the range covers.
+    """
+    ensure_db()  # Safety: ensure table exists before querying
+    filters = filters or {}
 
     if filters.get("group_by") == "domain":
-        query = "SELECT domain, COUNT(*) as count FROM bounces GROUP BY domain ORDER BY count DESC"
+        return domain_counts()
+
+    clause, params = filter_clause(filters)
+    query = "SELECT * FROM bounces WHERE 1=1" + clause
+
+    rows = []
+    if reads_archive(filters):
+        from retention import archived_bounces
+        rows.extend(archived_bounces(filters))
 
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(query, params)
-    rows = [dict(row) for row in cur.fetchall()]
+    rows.extend(dict(row) for row in cur.fetchall())
     conn.close()
     return rows
 
 
-def count_bounces(filters=None):
-    init_db()  # Safety: ensure table exists before counting
+def iter_bounces(filters=None, chunk_size=1000):
+    """Yield lists of up to chunk_size bounce rows matching filters.
+
+    Rows are read in id order one chunk at a time, so memory stays flat
+    regardless of the result size. Safe to consume from a thread pool.
+    """
+    ensure_db()
     filters = filters or {}
-    query = "SELECT COUNT(*) FROM bounces WHERE 1=1"
-    params = []
 
-    if "status" in filters:
-        query += " AND status=?"
-        params.append(filters["status"])
-    if "domain" in filters:
-        query += " AND domain=?"
-        params.append(filters["domain"])
+    if reads_archive(filters):
+        from retention import archived_bounces
+        chunk = []
+        for row in archived_bounces(filters):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    clause, params = filter_clause(filters)
+    query = "SELECT * FROM bounces WHERE id > ?" + clause + " ORDER BY id LIMIT ?"
+    # Consumers may resume the generator on different worker threads
+    conn = get_connection(check_same_thread=False)
+    try:
+        last_id = 0
+        while True:
+            # One short query per chunk (keyed on the last id), so no read
+            # lock is held between chunks and writers are never blocked
+            # by a slow export
+            rows = conn.execute(query, [last_id] + params + [chunk_size]).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            yield [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def latest_bounces(filters=None, limit=10):
+    """Newest live-table rows matching filters, newest first"""
+    ensure_db()
+    clause, params = filter_clause(filters or {})
+    conn = get_connection()
+    rows = [dict(row) for row in conn.execute(
+        "SELECT * FROM bounces WHERE 1=1" + clause + " ORDER BY id DESC LIMIT ?", params + [limit])]
+    conn.close()
+    return rows
+
+
+def bounces_after(last_id, limit=500, conn=None):
+    """Rows with id > last_id, oldest first (live dashboard feed)"""
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        return [dict(row) for row in conn.execute(
+            "SELECT * FROM bounces WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit))]
+    finally:
+        if own:
+            conn.close()
+
+
+def domain_counts(conn=None):
+    """Bounce count per domain, including archived periods"""
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        return [dict(row) for row in conn.execute("""
+            SELECT domain, SUM(count) as count FROM (
+                SELECT domain, COUNT(*) as count FROM bounces GROUP BY domain
+                UNION ALL
+                SELECT domain, SUM(count) as count FROM bounce_rollups GROUP BY domain
+            ) GROUP BY domain ORDER BY count DESC
+        """)]
+    finally:
+        if own:
+            conn.close()
+
+
+def dashboard_snapshot(recent=10):
+    """Total, per-domain counts and newest rows read in one transaction.
+
+    last_id is the newest id the snapshot covers; a live feed started
+    from it neither repeats nor misses rows.
+    """
+    ensure_db()
+    conn = get_connection()
+    try:
+        # One read transaction: a commit cannot land between the queries
+        conn.execute("BEGIN")
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM bounces").fetchone()[0]
+        total = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM bounces)"
+            " + (SELECT COALESCE(SUM(count), 0) FROM bounce_rollups)").fetchone()[0]
+        domains = domain_counts(conn)
+        rows = [dict(row) for row in conn.execute(
+            "SELECT * FROM bounces ORDER BY id DESC LIMIT ?", (recent,))]
+        conn.rollback()
+    finally:
+        conn.close()
+    return {"last_id": last_id, "total": total, "domains": domains, "recent": rows}
+
+
+def count_bounces(filters=None):
+    """Number of bounces matching filters, including archived periods"""
+    ensure_db()  # Safety: ensure table exists before counting
+    filters = filters or {}
+    clause, params = filter_clause(filters)
 
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(query, params)
+    cur.execute("SELECT COUNT(*) FROM bounces WHERE 1=1" + clause, params)
     total = cur.fetchone()[0]
+
+    if reads_archive(filters):
+        conn.close()
+        # Rollups are per month; date ranges need the archived rows
+        from retention import count_archived
+        return total + count_archived(filters)
+
+    clause, params = filter_clause(filters, dates=False)
+    cur.execute("SELECT COALESCE(SUM(count), 0) FROM bounce_rollups WHERE 1=1" + clause, params)
+    total += cur.fetchone()[0]
     conn.close()
-    return total
\ No newline at end of file
+    return total
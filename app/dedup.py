@@ -0,0 +1,158 @@
+"""
+Duplicate bounce detection.
+- Fingerprint = hash of the original Message-ID, the failed recipient and
+  the DSN status class (2/4/5), taken from the bounce's MIME parts.
+- Fingerprints seen within DEDUP_TTL_HOURS are duplicates: an in-memory
+  dict answers repeat lookups in O(1), the bounce_fingerprints table
+  (indexed, pruned by age) carries them across runs and processes.
+- A fingerprint is stored together with its bounce row, never before it.
+"""
+
+import re
+import time
+import hashlib
+import threading
+from email.parser import HeaderParser
+
+from db import ensure_db, get_connection
+
+MESSAGE_ID_RE = re.compile(r"^Message-ID:\s*(<[^>\s]+>)", re.I | re.M)
+STATUS_RE = re.compile(r"^([245])\.\d{1,3}\.\d{1,3}$")
+
+
+# ============================================
+# Fingerprinting
+# ============================================
+
+def original_message_id(msg):
+    """Message-ID of the message that bounced, if the DSN includes it"""
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if content_type == "message/rfc822":
+            payload = part.get_payload()
+            if isinstance(payload, list) and payload and payload[0].get("Message-ID"):
+                return payload[0]["Message-ID"].strip()
+        elif content_type == "text/rfc822-headers":
+            headers = HeaderParser().parsestr(part.get_payload(decode=True).decode(errors="ignore"))
+            if headers.get("Message-ID"):
+                return headers["Message-ID"].strip()
+
+    # Non-MIME bounces often quote the original headers inline
+    for part in msg.walk():
+        if part.get_content_maintype() == "text":
+            try:
+                text = part.get_payload(decode=True).decode(errors="ignore")
+            except Exception:
+                continue
+            match = MESSAGE_ID_RE.search(text)
+            if match:
+                return match.group(1)
+    return None
+
+
+def delivery_status(msg):
+    """(recipient, status class) from the first message/delivery-status block"""
+    for part in msg.walk():
+        if part.get_content_type() != "message/delivery-status":
+            continue
+        blocks = part.get_payload()
+        if not isinstance(blocks, list):
+            continue
+        for block in blocks:
+            recipient = block.get("Final-Recipient") or block.get("Original-Recipient")
+            if not recipient:
+                continue
+            recipient = recipient.split(";", 1)[-1].strip()
+            status = (block.get("Status") or "").strip()
+            match = STATUS_RE.match(status)
+            if match:
+                return recipient, match.group(1)
+            return recipient, (block.get("Action") or "").strip().lower()
+    return None, None
+
+
+def bounce_fingerprint(msg, status):
+    """Stable hash for one failed delivery.
+
+    None (no deduplication) unless the bounce names both the original
+    Message-ID and the failed recipient; the bounce's own To: is the
+    original sender and would merge failures for different recipients.
+    """
+    message_id = original_message_id(msg)
+    if not message_id:
+        return None
+    recipient, status_class = delivery_status(msg)
+    if not recipient:
+        return None
+    key = "\0".join([message_id, recipient, status_class or status])
+    return hashlib.sha1(key.lower().encode("utf-8")).hexdigest()
+
+
+# ============================================
+# Recent fingerprint index
+# ============================================
+
+class FingerprintIndex:
+    """Set of fingerprints seen within the last `ttl` seconds"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._seen = {}  # fingerprint -> first seen (epoch seconds)
+        self._lock = threading.Lock()
+
+    def record_once(self, fingerprint, write, now=None):
+        """Run write(conn) unless fingerprint was seen within the TTL.
+
+        The fingerprint is stored in the same transaction as write(), so a
+        failed write leaves no fingerprint behind and the bounce is retried
+        on the next run. Returns False for a duplicate.
+        """
+        now = time.time() if now is None else now
+        horizon = now - self.ttl
+        with self._lock:
+            first_seen = self._seen.get(fingerprint)
+            if first_seen is not None and first_seen >= horizon:
+                return False
+
+            ensure_db()
+            conn = get_connection()
+            try:
+                with conn:
+                    # Serializes the check-then-insert across processes
+                    conn.execute("BEGIN IMMEDIATE")
+                    row = conn.execute("SELECT seen FROM bounce_fingerprints WHERE fingerprint=?",
+                                       (fingerprint,)).fetchone()
+                    if row is not None and row[0] >= horizon:
+                        self._seen[fingerprint] = row[0]
+                        return False
+                    write(conn)
+                    conn.execute("INSERT OR REPLACE INTO bounce_fingerprints (fingerprint, seen) VALUES (?, ?)",
+                                 (fingerprint, now))
+            finally:
+                conn.close()
+            self._seen[fingerprint] = now
+            return True
+
+    def prune(self, now=None):
+        """Forget fingerprints older than the TTL (memory and table)"""
+        horizon = (time.time() if now is None else now) - self.ttl
+        with self._lock:
+            self._seen = {fp: seen for fp, seen in self._seen.items() if seen >= horizon}
+            ensure_db()
+            conn = get_connection()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM bounce_fingerprints WHERE seen < ?", (horizon,))
+            finally:
+                conn.close()
+
+
+# Shared per process, so a long-lived scheduler keeps its warm set
+_index = None
+
+
+def get_index(ttl):
+    global _index
+    if _index is None or _index.ttl != ttl:
+        _index = FingerprintIndex(ttl)
+    return _index
@@ -0,0 +1,106 @@
+"""
+Lightweight entry point for one-off job runs (web UI buttons, manual runs).
+Takes the same single-flight lock as the scheduler, then runs a cheap
+check and only imports the job module when there is work to do:
+- bounces   : IMAP STATUS (MESSAGES) on every account's inbox
+- retry     : row count of retry_queue
+- summary   : always runs
+- retention : always runs (no-op unless RETENTION_DAYS is set)
+
+Usage: python dispatch.py {bounces|retry|summary|retention} [--force]
+"""
+
+import sys
+import sqlite3
+
+from config import load_config
+from locks import job_lock
+
+
+def pending_bounces(config):
+    """Number of messages waiting in the inboxes of all accounts"""
+    from imap_client import connect_imap
+
+    total = 0
+    for account in config["IMAP_ACCOUNTS"]:
+        inbox = account["IMAP_FOLDER_TEST"] if config["IMAP_TEST_MODE"] else account["IMAP_FOLDER_INBOX"]
+        try:
+            mail = connect_imap(account)
+            result, data = mail.status(f'"{inbox}"', "(MESSAGES)")
+            mail.logout()
+        except Exception as e:
+            # Let the full processor deal with (and log) the failure
+            print(f"[{account['NAME']}] Status check failed: {e}")
+            return None
+        if result == "OK":
+            count = int(data[0].decode().rsplit("MESSAGES", 1)[1].strip(" )"))
+            print(f"[{account['NAME']}] {count} message(s) in {inbox}")
+            total += count
+    return total
+
+
+def pending_retries():
+    """Number of queued retry messages (0 if the queue was never created)"""
+    from db import DB_PATH
+
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        return 0
+
+
+def run_bounces(force=False):
+    if not force:
+        pending = pending_bounces(load_config())
+        if pending == 0:
+            print("No messages to process")
+            return
+    from process_bounces import process_mailbox
+    process_mailbox()
+
+
+def run_retry(force=False):
+    if not force and pending_retries() == 0:
+        print("Retry queue is empty")
+        return
+    from retry_queue import process_retry_queue
+    process_retry_queue()
+
+
+def run_summary(force=False):
+    from daily_summary import send_summary
+    send_summary()
+
+
+def run_retention(force=False):
+    from retention import archive_old_bounces
+    print(f"Archived {archive_old_bounces(load_config())} rows")
+
+
+JOBS = {
+    "bounces": run_bounces,
+    "retry": run_retry,
+    "summary": run_summary,
+    "retention": run_retention,
+}
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith("--")]
+    if len(args) != 1 or args[0] not in JOBS:
+        print(__doc__.strip())
+        return 2
+    with job_lock(args[0]) as acquired:
+        if not acquired:
+            print(f"Job '{args[0]}' is already running")
+            return 0
+        JOBS[args[0]](force="--force" in argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
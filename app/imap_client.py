@@ -0,0 +1,24 @@
+"""
+Blocking IMAP login shared by the processor, the scheduler's warm
+connections and dispatch.py's cheap pending-work check.
+Only imports imaplib, so dispatch.py stays fast to start.
+"""
+
+import imaplib
+import logging
+
+logger = logging.getLogger("process_bounces")
+
+
+def connect_imap(config):
+    """Establish IMAP connection with SSL or STARTTLS"""
+    logger.debug(f"[DEBUG] Connecting to IMAP {config['IMAP_SERVER']}:{config['IMAP_PORT']} secure={config['IMAP_SECURE']}")
+    if config["IMAP_SECURE"] == "ssl":
+        mail = imaplib.IMAP4_SSL(config["IMAP_SERVER"], config["IMAP_PORT"])
+    else:
+        mail = imaplib.IMAP4(config["IMAP_SERVER"], config["IMAP_PORT"])
+        if config["IMAP_SECURE"] == "starttls":
+            mail.starttls()
+    mail.login(config["IMAP_USER"], config["IMAP_PASS"])
+    logger.debug("[DEBUG] IMAP login successful")
+    return mail
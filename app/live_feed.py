@@ -0,0 +1,150 @@
+"""
+Live-tail feed of new bounces for the dashboard.
+- One poller per web process checks PRAGMA data_version (a counter that
+  changes only when another connection commits) and reads rows past the
+  last seen id only when it moved.
+- New rows go into a small shared buffer; every subscriber reads from it,
+  so open dashboards cost no queries of their own.
+- A subscriber that fell behind the buffer (e.g. reconnecting after a
+  long gap) catches up from the table once, then rejoins the buffer.
+- The poller only runs while someone is subscribed.
+"""
+
+import asyncio
+import logging
+
+from db import ensure_db, get_connection, bounces_after
+
+logger = logging.getLogger("live_feed")
+
+# How often the database is checked for commits
+POLL_SECONDS = 1.0
+# Recent rows kept for subscribers; older watermarks catch up from the table
+BUFFER_ROWS = 500
+# Idle subscribers get an empty batch this often (SSE keep-alive)
+HEARTBEAT_SECONDS = 15.0
+
+
+class LiveFeed:
+    def __init__(self, poll_seconds=POLL_SECONDS, buffer_rows=BUFFER_ROWS):
+        self.poll_seconds = poll_seconds
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.floor = 0      # rows with id > floor are all in self.rows
+        self.last_id = 0
+        self.subscribers = 0
+        self._conn = None
+        self._version = None
+        self._task = None
+        self._start_lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+
+    # ----- polling (runs in a worker thread) -----
+
+    def _open(self):
+        ensure_db()
+        # data_version is per connection, so the poller keeps its own
+        self._conn = get_connection(check_same_thread=False)
+        self._version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        row = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bounces").fetchone()
+        self.rows = []
+        self.floor = self.last_id = row[0]
+
+    def _poll(self):
+        """New rows since the last poll ([] if nothing was committed)"""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return []
+        self._version = version
+        new_rows = []
+        last_id = self.last_id
+        while True:
+            batch = bounces_after(last_id, self.buffer_rows, conn=self._conn)
+            new_rows.extend(batch)
+            if len(batch) < self.buffer_rows:
+                return new_rows
+            last_id = batch[-1]["id"]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                try:
+                    new_rows = await asyncio.to_thread(self._poll)
+                except Exception as e:
+                    logger.error(f"Live feed poll failed: {e}")
+                    new_rows = []
+                if new_rows:
+                    # Buffer and watermark only change here, on the event loop
+                    self.rows.extend(new_rows)
+                    self.last_id = new_rows[-1]["id"]
+                    if len(self.rows) > self.buffer_rows:
+                        evicted = self.rows[:-self.buffer_rows]
+                        self.rows = self.rows[-self.buffer_rows:]
+                        self.floor = evicted[-1]["id"]
+                    # Wake every waiting subscriber, then arm a fresh event
+                    self._changed.set()
+                    self._changed = asyncio.Event()
+                await asyncio.sleep(self.poll_seconds)
+        finally:
+            self._close()
+            self._task = None
+
+    async def _start(self):
+        async with self._start_lock:
+            if self._task is None:
+                await asyncio.to_thread(self._open)
+                self._task = asyncio.create_task(self._run())
+
+    # ----- subscribers -----
+
+    def rows_after(self, since):
+        """Buffered rows past `since`, or None if the buffer no longer covers it"""
+        if since >= self.last_id:
+            return []
+        if since < self.floor:
+            return None
+        return [row for row in self.rows if row["id"] > since]
+
+    async def subscribe(self, since=None, heartbeat=HEARTBEAT_SECONDS):
+        """Yield lists of rows with id > since as they arrive ([] = heartbeat).
+
+        since=None starts from the newest row at subscription time.
+        """
+        self.subscribers += 1
+        try:
+            await self._start()
+            if since is None:
+                since = self.last_id
+            while True:
+                changed = self._changed
+                rows = self.rows_after(since)
+                if rows is None:
+                    rows = await asyncio.to_thread(bounces_after, since, self.buffer_rows)
+                    if not rows:
+                        # Gap was archived away; resume from the buffer
+                        since = self.floor
+                        continue
+                if rows:
+                    since = rows[-1]["id"]
+                    yield rows
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield []
+        finally:
+            self.subscribers -= 1
+
+
+def counter_deltas(rows):
+    """Per-domain and per-status counts for a batch of new rows"""
+    domains, statuses = {}, {}
+    for row in rows:
+        domains[row["domain"]] = domains.get(row["domain"], 0) + 1
+        statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+    return {"domains": domains, "statuses": statuses}
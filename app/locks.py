@@ -0,0 +1,30 @@
+"""
+Single-flight job locks.
+Non-blocking flock() on a file next to the database, so the scheduler,
+manual runs from the web UI and dispatch.py never run the same job twice
+at once, whichever process started it.
+"""
+
+import os
+import fcntl
+from contextlib import contextmanager
+
+from db import DB_PATH
+
+LOCK_DIR = os.getenv("LOCK_DIR", os.path.dirname(DB_PATH) or ".")
+
+
+@contextmanager
+def job_lock(name):
+    """Yield True if the lock for `name` was acquired, False if it is held"""
+    path = os.path.join(LOCK_DIR, f"{name}.lock")
+    with open(path, "a") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
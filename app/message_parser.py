@@ -0,0 +1,160 @@
+"""
+Memory-bounded message parsing.
+- Feeds raw message bytes into email.parser.BytesFeedParser incrementally.
+- Tracks the MIME structure line by line; headers and boundaries always
+  reach the parser, body lines are dropped once a part exceeds
+  PART_MAX_BYTES or the message exceeds MESSAGE_MAX_BYTES.
+- A body line longer than the remaining budget is dropped as it arrives,
+  so a part without line breaks never accumulates in memory.
+- Bounces keep their DSN text, only the bulky returned attachments go.
+"""
+
+import email
+from email.parser import BytesFeedParser, BytesHeaderParser
+
+CHUNK_SIZE = 64 * 1024
+
+# Header blocks larger than this are still fed, just not inspected
+MAX_HEADER_BYTES = 256 * 1024
+# Longer body lines are never boundaries (RFC 5322 caps lines at 998)
+MAX_BOUNDARY_LINE = 1000
+
+
+class BoundedMessageParser:
+    """Incremental parser enforcing per-part and per-message body caps.
+
+    Usable as a literal sink: call write() with each chunk, then close()
+    to get the email.message.Message.
+    """
+
+    def __init__(self, max_message_bytes, max_part_bytes):
+        self.max_message_bytes = max_message_bytes
+        self.max_part_bytes = max_part_bytes
+        self.truncated_bytes = 0
+        self._parser = BytesFeedParser()
+        self._pending = b""
+        self._skipping = False  # dropping the rest of an oversized body line
+        self._boundaries = []
+        self._in_headers = True
+        self._header_lines = []
+        self._header_size = 0
+        self._part_bytes = 0
+        self._body_bytes = 0
+
+    # ----------------------------------------
+    # Sink interface
+    # ----------------------------------------
+
+    def write(self, chunk):
+        if self._skipping:
+            end = chunk.find(b"\n")
+            if end < 0:
+                self.truncated_bytes += len(chunk)
+                return
+            self.truncated_bytes += end + 1
+            self._skipping = False
+            chunk = chunk[end + 1:]
+        data = self._pending + chunk
+        lines = data.split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._line(line + b"\n")
+        if not self._in_headers and len(self._pending) > max(self._body_budget(), MAX_BOUNDARY_LINE):
+            # Can neither fit nor be a boundary: it would be dropped whole
+            self.truncated_bytes += len(self._pending)
+            self._pending = b""
+            self._skipping = True
+
+    def close(self):
+        if self._pending:
+            self._line(self._pending)
+            self._pending = b""
+        self._skipping = False
+        return self._parser.close()
+
+    # ----------------------------------------
+    # Structure tracking
+    # ----------------------------------------
+
+    def _line(self, line):
+        if self._in_headers:
+            self._parser.feed(line)
+            if line.strip():
+                if self._header_size < MAX_HEADER_BYTES:
+                    self._header_lines.append(line)
+                    self._header_size += len(line)
+            else:
+                self._end_of_headers()
+            return
+
+        if line.startswith(b"--") and self._boundaries:
+            marker = line.rstrip()
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                boundary = self._boundaries[depth]
+                if marker == b"--" + boundary:
+                    # Next part of this multipart; inner ones are finished
+                    del self._boundaries[depth + 1:]
+                    self._parser.feed(line)
+                    self._start_headers()
+                    return
+                if marker == b"--" + boundary + b"--":
+                    # Closing delimiter; the epilogue is body of the parent
+                    del self._boundaries[depth:]
+                    self._parser.feed(line)
+                    self._part_bytes = 0
+                    return
+
+        self._body_line(line)
+
+    def _body_budget(self):
+        return min(self.max_part_bytes - self._part_bytes,
+                   self.max_message_bytes - self._body_bytes)
+
+    def _body_line(self, line):
+        size = len(line)
+        if (self._part_bytes + size > self.max_part_bytes
+                or self._body_bytes + size > self.max_message_bytes):
+            self.truncated_bytes += size
+            return
+        self._part_bytes += size
+        self._body_bytes += size
+        self._parser.feed(line)
+
+    def _start_headers(self):
+        self._in_headers = True
+        self._header_lines = []
+        self._header_size = 0
+
+    def _end_of_headers(self):
+        headers = BytesHeaderParser().parsebytes(b"".join(self._header_lines))
+        self._header_lines = []
+        self._part_bytes = 0
+
+        content_type = headers.get_content_type()
+        boundary = headers.get_boundary()
+        if headers.get_content_maintype() == "multipart" and boundary:
+            self._boundaries.append(boundary.encode("ascii", "replace"))
+        if content_type == "message/rfc822":
+            # The body starts with the headers of the enclosed message
+            self._start_headers()
+            return
+        self._in_headers = False
+
+
+def parse_message_bytes(raw, max_message_bytes, max_part_bytes):
+    """Parse an already-fetched message through a BoundedMessageParser"""
+    parser = BoundedMessageParser(max_message_bytes, max_part_bytes)
+    view = memoryview(raw)
+    for start in range(0, len(view), CHUNK_SIZE):
+        parser.write(bytes(view[start:start + CHUNK_SIZE]))
+    return parser.close(), parser.truncated_bytes
+
+
+def parse_message(raw, mode="stream", max_message_bytes=None, max_part_bytes=None):
+    """Parse raw bytes in "full" (email.message_from_bytes) or "stream" mode.
+
+    Returns (message, truncated_bytes).
+    """
+    if mode == "full" or max_message_bytes is None:
+        return email.message_from_bytes(raw), 0
+    return parse_message_bytes(raw, max_message_bytes, max_part_bytes or max_message_bytes)
@@ -1,14 +1,14 @@
-import os
-import imaplib
-import email
-import smtplib
 import logging
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import load_config
 from db import insert_bounce, init_db
 from bounce_rules import classify_bounce
+from aioimap import AsyncIMAP4, LiteralTooLarge, MAX_LITERAL
+from imap_client import connect_imap
+from message_parser import BoundedMessageParser, parse_message
+from dedup import bounce_fingerprint, get_index
 
 # ============================================
 # Setup logging
@@ -19,10 +19,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger("process_bounces")
 
-ENV_FILE = "data/.env"
-
-# Jinja2 template environment
-TEMPLATE_ENV = Environment(loader=FileSystemLoader("docs/templates"))
+# Jinja2 template environment (built on first notification)
+TEMPLATE_ENV = None
 
 # SMTP status code → description map
 SMTP_DESCRIPTIONS = {
@@ -42,62 +40,31 @@ SMTP_DESCRIPTIONS = {
     "554": "Transaction failed – message rejected as spam or blocked"
 }
 
+# Per-server connection slots, keyed by (server, port, user)
+_CONNECTION_SLOTS = {}
+_CONNECTION_SLOTS_LOCK = threading.Lock()
 
-def load_config():
-    """Reload config from .env each run (supports real-time toggle)"""
-    load_dotenv(ENV_FILE, override=True)
-
-    config = {
-        # IMAP
-        "IMAP_SERVER": os.getenv("IMAP_SERVER"),
-        "IMAP_PORT": int(os.getenv("IMAP_PORT", "143")),
-        "IMAP_USER": os.getenv("IMAP_USER"),
-        "IMAP_PASS": os.getenv("IMAP_PASS"),
-        "IMAP_SECURE": os.getenv("IMAP_SECURE", "none").lower(),
-
-        # IMAP Folders (normal)
-        "IMAP_FOLDER_INBOX": os.getenv("IMAP_FOLDER_INBOX", "INBOX"),
-        "IMAP_FOLDER_PROCESSED": os.getenv("IMAP_FOLDER_PROCESSED", "PROCESSED"),
-        "IMAP_FOLDER_PROBLEM": os.getenv("IMAP_FOLDER_PROBLEM", "PROBLEM"),
-        "IMAP_FOLDER_SKIPPED": os.getenv("IMAP_FOLDER_SKIPPED", "SKIPPED"),
-
-        # IMAP Folders (test mode)
-        "IMAP_FOLDER_TEST": os.getenv("IMAP_FOLDER_TEST", "TEST"),
-        "IMAP_FOLDER_TESTPROCESSED": os.getenv("IMAP_FOLDER_TESTPROCESSED", "TESTPROCESSED"),
-        "IMAP_FOLDER_TESTPROBLEM": os.getenv("IMAP_FOLDER_TESTPROBLEM", "TESTPROBLEM"),
-        "IMAP_FOLDER_TESTSKIPPED": os.getenv("IMAP_FOLDER_TESTSKIPPED", "TESTSKIPPED"),
-
-        # Flags
-        "IMAP_TEST_MODE": os.getenv("IMAP_TEST_MODE", "false").lower() == "true",
-
-        # SMTP
-        "SMTP_SERVER": os.getenv("SMTP_SERVER", "localhost"),
-        "SMTP_PORT": int(os.getenv("SMTP_PORT", "25")),
-        "SMTP_USER": os.getenv("SMTP_USER", ""),
-        "SMTP_PASS": os.getenv("SMTP_PASS", ""),
-
-        # Notifications
-        "NOTIFY_CC": [e.strip() for e in os.getenv("NOTIFY_CC", "").split(",") if e.strip()],
-        "NOTIFY_CC_TEST": [e.strip() for e in os.getenv("NOTIFY_CC_TEST", "").split(",") if e.strip()],
-
-        # Org info
-        "ORG_NAME": os.getenv("ORG_NAME", "Support Team"),
-        "ORG_EMAIL": os.getenv("ORG_EMAIL", "support@example.com"),
-        "ORG_LOGO_URL": os.getenv("ORG_LOGO_URL", "")
-    }
-    return config
 
+def connection_slot(config, account):
+    """Semaphore limiting concurrent logins to the same server/user"""
+    key = (account["IMAP_SERVER"], account["IMAP_PORT"], account["IMAP_USER"])
+    with _CONNECTION_SLOTS_LOCK:
+        if key not in _CONNECTION_SLOTS:
+            _CONNECTION_SLOTS[key] = threading.BoundedSemaphore(max(1, config["IMAP_MAX_CONNECTIONS"]))
+        return _CONNECTION_SLOTS[key]
 
-def connect_imap(config):
-    """Establish IMAP connection with SSL or STARTTLS"""
-    logger.debug(f"[DEBUG] Connecting to IMAP {config['IMAP_SERVER']}:{config['IMAP_PORT']} secure={config['IMAP_SECURE']}")
-    if config["IMAP_SECURE"] == "ssl":
-        mail = imaplib.IMAP4_SSL(config["IMAP_SERVER"], config["IMAP_PORT"])
-    else:
-        mail = imaplib.IMAP4(config["IMAP_SERVER"], config["IMAP_PORT"])
-        if config["IMAP_SECURE"] == "starttls":
-            mail.starttls()
-    mail.login(config["IMAP_USER"], config["IMAP_PASS"])
+
+async def connect_imap_async(config, max_literal=MAX_LITERAL):
+    """Asyncio counterpart of connect_imap()"""
+    logger.debug(f"[DEBUG] Connecting to IMAP (asyncio) {config['IMAP_SERVER']}:{config['IMAP_PORT']} secure={config['IMAP_SECURE']}")
+    mail = AsyncIMAP4(config["IMAP_SERVER"], config["IMAP_PORT"], secure=config["IMAP_SECURE"],
+                      max_literal=max_literal)
+    await mail.connect()
+    try:
+        await mail.login(config["IMAP_USER"], config["IMAP_PASS"])
+    except Exception:
+        await mail.close()
+        raise
     logger.debug("[DEBUG] IMAP login successful")
     return mail
 
@@ -106,95 +73,280 @@ def move_message(mail, num, folder):
     """Move message to target folder"""
     try:
         mail.copy(num, folder)
-        mail.store(num, "+FLAGS", "\\Deleted")
+        mail.store(num, "+FLAGS.SILENT", "\\Deleted")
+        logger.debug(f"[DEBUG] Moving message {num} → {folder}")
+    except Exception as e:
+        logger.error(f"Failed to move message {num} → {folder}: {e}")
+
+
+async def move_message_async(mail, num, folder):
+    """Asyncio counterpart of move_message(); COPY and STORE are pipelined"""
+    try:
+        results = await asyncio.gather(
+            mail.copy(num, folder),
+            mail.store(num, "+FLAGS.SILENT", "\\Deleted"),
+        )
+        if any(typ != "OK" for typ, _ in results):
+            raise RuntimeError(results)
         logger.debug(f"[DEBUG] Moving message {num} → {folder}")
     except Exception as e:
         logger.error(f"Failed to move message {num} → {folder}: {e}")
 
 
-def process_mailbox():
-    """Connect to IMAP and process bounce emails"""
+def read_message(config, raw_email):
+    """Parse fetched bytes according to PARSE_MODE"""
+    msg, truncated = parse_message(raw_email, config["PARSE_MODE"],
+                                   config["MESSAGE_MAX_BYTES"], config["PART_MAX_BYTES"])
+    if truncated:
+        logger.debug(f"[DEBUG] Discarded {truncated} bytes of oversized message parts")
+    return msg
+
+
+def account_folders(config, account):
+    """Return (inbox, processed, problem, skipped) for the current mode"""
+    if config["IMAP_TEST_MODE"]:
+        return (account["IMAP_FOLDER_TEST"], account["IMAP_FOLDER_TESTPROCESSED"],
+                account["IMAP_FOLDER_TESTPROBLEM"], account["IMAP_FOLDER_TESTSKIPPED"])
+    return (account["IMAP_FOLDER_INBOX"], account["IMAP_FOLDER_PROCESSED"],
+            account["IMAP_FOLDER_PROBLEM"], account["IMAP_FOLDER_SKIPPED"])
+
+
+def route_folder(status, processed, problem, skipped):
+    """Pick the destination folder for a classified message"""
+    if status == "failed":
+        return processed
+    if status == "unknown":
+        return skipped
+    return problem
+
+
+def process_mailbox(connections=None):
+    """Process every configured bounce mailbox concurrently.
+
+    connections: optional warm connection pool (see scheduler.py) used
+    instead of logging in to IMAP/SMTP on every run.
+    """
     config = load_config()
     init_db()
+    if config["DEDUP_TTL_HOURS"] > 0:
+        get_index(config["DEDUP_TTL_HOURS"] * 3600).prune()
+
+    accounts = config["IMAP_ACCOUNTS"]
+    workers = max(1, min(config["IMAP_MAX_WORKERS"], len(accounts)))
+    logger.debug(f"[DEBUG] Processing {len(accounts)} account(s) with {workers} worker(s), engine={config['IMAP_ENGINE']}")
+
+    if config["IMAP_ENGINE"] == "asyncio":
+        asyncio.run(process_accounts_async(config, accounts, workers))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imap") as pool:
+        for account in accounts:
+            pool.submit(process_account, config, account, connections)
+
+
+def process_account(config, account, connections=None):
+    """Connect to one IMAP account and process its bounce emails"""
+    name = account["NAME"]
 
     try:
-        mail = connect_imap(config)
-
-        if config["IMAP_TEST_MODE"]:
-            inbox = config["IMAP_FOLDER_TEST"]
-            processed = config["IMAP_FOLDER_TESTPROCESSED"]
-            problem = config["IMAP_FOLDER_TESTPROBLEM"]
-            skipped = config["IMAP_FOLDER_TESTSKIPPED"]
-            logger.debug("[DEBUG] Running in TEST MODE")
-        else:
-            inbox = config["IMAP_FOLDER_INBOX"]
-            processed = config["IMAP_FOLDER_PROCESSED"]
-            problem = config["IMAP_FOLDER_PROBLEM"]
-            skipped = config["IMAP_FOLDER_SKIPPED"]
-            logger.debug("[DEBUG] Running in NORMAL MODE")
-
-        mail.select(inbox)
-        result, data = mail.search(None, "ALL")
-        if result != "OK":
-            logger.warning("No messages found!")
-            return
-
-        logger.debug(f"[DEBUG] Found {len(data[0].split())} messages")
-
-        for num in data[0].split():
-            logger.debug(f"[DEBUG] Fetching message {num.decode()}")
-            result, msg_data = mail.fetch(num, "(RFC822)")
+        with connection_slot(config, account):
+            mail = connections.imap(account) if connections else connect_imap(account)
+
+            inbox, processed, problem, skipped = account_folders(config, account)
+            logger.debug(f"[DEBUG] [{name}] Running in {'TEST' if config['IMAP_TEST_MODE'] else 'NORMAL'} MODE")
+
+            mail.select(inbox)
+            result, data = mail.search(None, "ALL")
+            if result != "OK":
+                logger.warning(f"[{name}] No messages found!")
+                return
+
+            logger.debug(f"[DEBUG] [{name}] Found {len(data[0].split())} messages")
+
+            for num in data[0].split():
+                logger.debug(f"[DEBUG] [{name}] Fetching message {num.decode()}")
+                result, msg_data = mail.fetch(num, "(RFC822)")
+                if result != "OK":
+                    logger.warning(f"[{name}] Error fetching message {num}")
+                    continue
+
+                msg = read_message(config, msg_data[0][1])
+                del msg_data  # don't keep the raw bytes alongside the parsed tree
+
+                status = handle_message(config, account, msg, connections)
+
+                # Folder routing
+                move_message(mail, num, route_folder(status, processed, problem, skipped))
+
+            mail.expunge()
+            if connections is None:
+                mail.logout()
+
+    except Exception as e:
+        logger.error("[%s] Error processing mailbox: %s", name, str(e))
+        if connections is not None:
+            connections.discard_imap(account)
+
+
+async def process_accounts_async(config, accounts, workers):
+    """Process all accounts on one event loop (IMAP_ENGINE=asyncio)"""
+    worker_slots = asyncio.Semaphore(workers)
+    server_slots = {}
+
+    async def run(account):
+        key = (account["IMAP_SERVER"], account["IMAP_PORT"], account["IMAP_USER"])
+        if key not in server_slots:
+            server_slots[key] = asyncio.Semaphore(max(1, config["IMAP_MAX_CONNECTIONS"]))
+        async with worker_slots, server_slots[key]:
+            await process_account_async(config, account)
+
+    await asyncio.gather(*(run(account) for account in accounts))
+
+
+async def process_account_async(config, account):
+    """Asyncio counterpart of process_account().
+
+    Up to IMAP_PIPELINE_DEPTH fetches are kept in flight while earlier
+    messages are classified and stored in a worker thread. In stream
+    mode each literal is parsed chunk by chunk as it is read; in full
+    mode messages over MESSAGE_MAX_BYTES are not kept and go to the
+    problem folder.
+    """
+    name = account["NAME"]
+    # In stream mode literals are parsed as they arrive off the wire
+    streaming = config["PARSE_MODE"] == "stream"
+
+    try:
+        mail = await connect_imap_async(
+            account, max_literal=MAX_LITERAL if streaming else config["MESSAGE_MAX_BYTES"])
+        try:
+            inbox, processed, problem, skipped = account_folders(config, account)
+            logger.debug(f"[DEBUG] [{name}] Running in {'TEST' if config['IMAP_TEST_MODE'] else 'NORMAL'} MODE")
+
+            await mail.select(inbox)
+            result, data = await mail.search(None, "ALL")
             if result != "OK":
-                logger.warning(f"Error fetching message {num}")
-                continue
-
-            raw_email = msg_data[0][1]
-            msg = email.message_from_bytes(raw_email)
-
-            # Extract
-            msg_to = msg.get("To", "")
-            msg_cc = msg.get("Cc", "")
-            subject = msg.get("Subject", "")
-            logger.debug(f"[DEBUG] Processing message: To={msg_to}, Cc={msg_cc}, Subject={subject}")
-
-            # Classify bounce
-            status, reason, domain = classify_bounce(msg)
-            logger.debug(f"[DEBUG] Classification: status={status}, reason={reason}, domain={domain}")
-
-            # Determine notification recipients
-            if config["IMAP_TEST_MODE"]:
-                notified_to = config["NOTIFY_CC_TEST"]
-                notified_cc = []
-            else:
-                notified_to = [e.strip() for e in msg_cc.split(",") if e.strip()]
-                notified_cc = config["NOTIFY_CC"]
-
-            # Save into DB
-            insert_bounce(msg_to, msg_cc, status, reason, domain,
-                          notified_to=",".join(notified_to),
-                          notified_cc=",".join(notified_cc))
-
-            # Send notification
-            if notified_to or notified_cc:
-                send_notification(config, subject, msg_to, msg_cc, status, reason, notified_to, notified_cc)
-
-            # Folder routing
-            if status == "failed":
-                move_message(mail, num, processed)
-            elif status == "unknown":
-                move_message(mail, num, skipped)
-            else:
-                move_message(mail, num, problem)
-
-        mail.expunge()
-        mail.logout()
+                logger.warning(f"[{name}] No messages found!")
+                return
+
+            nums = data[0].split()
+            logger.debug(f"[DEBUG] [{name}] Found {len(nums)} messages")
+
+            depth = max(1, config["IMAP_PIPELINE_DEPTH"])
+            fetches = {}
+            moves = []
+            try:
+                for i, num in enumerate(nums):
+                    # Keep the fetch window full
+                    for ahead in nums[i:i + depth]:
+                        if ahead not in fetches:
+                            logger.debug(f"[DEBUG] [{name}] Fetching message {ahead.decode()}")
+                            sink = (BoundedMessageParser(config["MESSAGE_MAX_BYTES"], config["PART_MAX_BYTES"])
+                                    if streaming else None)
+                            fetches[ahead] = asyncio.ensure_future(mail.fetch(ahead, "(RFC822)", sink=sink))
+
+                    try:
+                        result, msg_data = await fetches.pop(num)
+                    except LiteralTooLarge as e:
+                        logger.warning(f"[{name}] Message {num.decode()} not fetched: {e}")
+                        moves.append(asyncio.ensure_future(move_message_async(mail, num, problem)))
+                        continue
+                    if result != "OK":
+                        logger.warning(f"[{name}] Error fetching message {num}")
+                        continue
+
+                    if streaming:
+                        parser = msg_data[0][1]
+                        msg = parser.close()
+                        if parser.truncated_bytes:
+                            logger.debug(f"[DEBUG] Discarded {parser.truncated_bytes} bytes of oversized message parts")
+                    else:
+                        msg = read_message(config, msg_data[0][1])
+                    del msg_data
+
+                    status = await asyncio.to_thread(handle_message, config, account, msg)
+
+                    # Folder routing
+                    moves.append(asyncio.ensure_future(
+                        move_message_async(mail, num, route_folder(status, processed, problem, skipped))))
+
+                await asyncio.gather(*moves)
+            finally:
+                # On error, fetches still in the window were never awaited
+                for future in fetches.values():
+                    future.cancel()
+                await asyncio.gather(*fetches.values(), *moves, return_exceptions=True)
+
+            await mail.expunge()
+            await mail.logout()
+        finally:
+            await mail.close()
 
     except Exception as e:
-        logger.error("Error processing mailbox: %s", str(e))
+        logger.error("[%s] Error processing mailbox: %s", name, str(e))
+
+
+def handle_message(config, account, msg, connections=None):
+    """Classify one bounce, record it and notify. Returns the bounce status."""
+    name = account["NAME"]
+
+    # Extract
+    msg_to = msg.get("To", "")
+    msg_cc = msg.get("Cc", "")
+    subject = msg.get("Subject", "")
+    logger.debug(f"[DEBUG] [{name}] Processing message: To={msg_to}, Cc={msg_cc}, Subject={subject}")
+
+    # Classify bounce
+    status, reason, domain = classify_bounce(msg)
+    logger.debug(f"[DEBUG] [{name}] Classification: status={status}, reason={reason}, domain={domain}")
+
+    # Determine notification recipients
+    if config["IMAP_TEST_MODE"]:
+        notified_to = config["NOTIFY_CC_TEST"]
+        notified_cc = []
+    else:
+        notified_to = [e.strip() for e in msg_cc.split(",") if e.strip()]
+        notified_cc = config["NOTIFY_CC"]
+
+    # Save into DB
+    def record(conn=None):
+        insert_bounce(msg_to, msg_cc, status, reason, domain,
+                      notified_to=",".join(notified_to),
+                      notified_cc=",".join(notified_cc),
+                      account=name, conn=conn)
+
+    # Collapse repeat DSNs for the same failed delivery (delays, secondary MXs)
+    fingerprint = bounce_fingerprint(msg, status) if config["DEDUP_TTL_HOURS"] > 0 else None
+    if fingerprint:
+        if not get_index(config["DEDUP_TTL_HOURS"] * 3600).record_once(fingerprint, record):
+            logger.debug(f"[DEBUG] [{name}] Duplicate bounce {fingerprint[:12]}, not recorded or notified")
+            return status
+    else:
+        record()
+
+    # Send notification
+    if notified_to or notified_cc:
+        send_notification(config, subject, msg_to, msg_cc, status, reason, notified_to, notified_cc,
+                          connections=connections)
+
+    return status
 
 
-def send_notification(config, subject, to_addr, cc_addr, status, reason, notified_to, notified_cc):
+def get_template_env():
+    """Create the Jinja2 environment on first use (keeps empty runs cheap)"""
+    global TEMPLATE_ENV
+    if TEMPLATE_ENV is None:
+        from jinja2 import Environment, FileSystemLoader
+        TEMPLATE_ENV = Environment(loader=FileSystemLoader("docs/templates"))
+    return TEMPLATE_ENV
+
+
+def send_notification(config, subject, to_addr, cc_addr, status, reason, notified_to, notified_cc,
+                      connections=None):
     """Send bounce notification email (multipart text+html via templates)"""
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
 
     smtp_description = SMTP_DESCRIPTIONS.get(str(status), "Unrecognized SMTP status code")
 
@@ -210,8 +362,9 @@ def send_notification(config, subject, to_addr, cc_addr, status, reason, notifie
     }
 
     # Render templates
-    text_body = TEMPLATE_ENV.get_template("email_notification.txt").render(context)
-    html_body = TEMPLATE_ENV.get_template("email_notification.html").render(context)
+    template_env = get_template_env()
+    text_body = template_env.get_template("email_notification.txt").render(context)
+    html_body = template_env.get_template("email_notification.html").render(context)
 
     # Multipart message
     msg = MIMEMultipart("alternative")
@@ -228,12 +381,17 @@ def send_notification(config, subject, to_addr, cc_addr, status, reason, notifie
     all_recipients = notified_to + notified_cc
 
     try:
-        with smtplib.SMTP(config["SMTP_SERVER"], config["SMTP_PORT"]) as server:
-            if config["SMTP_USER"] and config["SMTP_PASS"]:
-                server.starttls()
-                server.login(config["SMTP_USER"], config["SMTP_PASS"])
-            logger.debug(f"[DEBUG] Sending notification → {all_recipients}")
-            server.sendmail(config["ORG_EMAIL"], all_recipients, msg.as_string())
+        logger.debug(f"[DEBUG] Sending notification → {all_recipients}")
+        if connections is not None:
+            connections.sendmail(config["SMTP_SERVER"], config["SMTP_PORT"],
+                                 config["SMTP_USER"], config["SMTP_PASS"],
+                                 config["ORG_EMAIL"], all_recipients, msg.as_string())
+        else:
+            with smtplib.SMTP(config["SMTP_SERVER"], config["SMTP_PORT"]) as server:
+                if config["SMTP_USER"] and config["SMTP_PASS"]:
+                    server.starttls()
+                    server.login(config["SMTP_USER"], config["SMTP_PASS"])
+                server.sendmail(config["ORG_EMAIL"], all_recipients, msg.as_string())
         print(f"Sent notification to {all_recipients}")
     except Exception as e:
         logger.error("Error sending notification: %s", str(e))
@@ -0,0 +1,229 @@
+"""
+Retention and archival of bounce history.
+- Rows older than RETENTION_DAYS move out of the live bounces table into
+  one archive per month: ARCHIVE_DIR/bounces-YYYY-MM.db (sqlite) or
+  ARCHIVE_DIR/bounces-YYYY-MM.ndjson.gz (ndjson).
+- Archived rows are counted into bounce_rollups (month, status, domain,
+  account) so totals and domain stats still cover all history.
+- The live database is switched to incremental auto-vacuum and the pages
+  freed by archiving are returned to the filesystem after each run.
+- archived_bounces() / count_archived() read the archive back for
+  date-filtered queries and counts.
+- Settings (RETENTION_DAYS, ARCHIVE_DIR, ARCHIVE_FORMAT,
+  RETENTION_VACUUM_PAGES) come from load_config(), read per call.
+"""
+
+import os
+import glob
+import gzip
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from config import load_config
+from db import BOUNCE_COLUMNS, get_connection, init_db, filter_clause, end_of_day
+
+# Rows moved per transaction
+BATCH_SIZE = 5000
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bounces (
+        id INTEGER PRIMARY KEY,
+        date TIMESTAMP,
+        email_to TEXT,
+        email_cc TEXT,
+        status TEXT,
+        reason TEXT,
+        domain TEXT,
+        notified_to TEXT,
+        notified_cc TEXT,
+        account TEXT
+    )
+"""
+
+
+# ============================================
+# Archiving
+# ============================================
+
+def archive_path(config, month):
+    suffix = "ndjson.gz" if config["ARCHIVE_FORMAT"] == "ndjson" else "db"
+    return os.path.join(config["ARCHIVE_DIR"], f"bounces-{month}.{suffix}")
+
+
+def write_archive(config, month, rows):
+    """Append rows to the month's archive (sqlite inserts are idempotent)"""
+    os.makedirs(config["ARCHIVE_DIR"], exist_ok=True)
+    if config["ARCHIVE_FORMAT"] == "ndjson":
+        with gzip.open(archive_path(config, month), "at", encoding="utf-8") as fh:
+            for row in rows:
+                fh.write(json.dumps(row) + "\n")
+        return
+
+    conn = sqlite3.connect(archive_path(config, month))
+    conn.execute(ARCHIVE_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bounces_date ON bounces(date)")
+    conn.executemany(
+        f"INSERT OR IGNORE INTO bounces ({', '.join(BOUNCE_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(BOUNCE_COLUMNS))})",
+        [[row.get(col) for col in BOUNCE_COLUMNS] for row in rows],
+    )
+    conn.commit()
+    conn.close()
+
+
+def archive_old_bounces(config=None, days=None):
+    """Move rows older than `days` (default RETENTION_DAYS) to the archive.
+
+    Returns the number of rows archived. RETENTION_DAYS=0 disables it.
+    """
+    config = config or load_config()
+    days = config["RETENTION_DAYS"] if days is None else days
+    if days <= 0:
+        return 0
+
+    init_db()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    archived = 0
+
+    while True:
+        rows = [dict(row) for row in conn.execute(
+            "SELECT * FROM bounces WHERE date < ? ORDER BY id LIMIT ?", (cutoff, BATCH_SIZE))]
+        if not rows:
+            break
+
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row["date"][:7], []).append(row)
+
+        # Archive first: a crash before the delete below only repeats work
+        # (sqlite archives ignore known ids, ndjson readers skip repeats)
+        for month, month_rows in by_month.items():
+            write_archive(config, month, month_rows)
+
+        with conn:
+            for month, month_rows in by_month.items():
+                counts = {}
+                for row in month_rows:
+                    key = (month, row["status"] or "", row["domain"] or "", row["account"] or "")
+                    counts[key] = counts.get(key, 0) + 1
+                conn.executemany(
+                    """INSERT INTO bounce_rollups (month, status, domain, account, count)
+                       VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT (month, status, domain, account)
+                       DO UPDATE SET count = count + excluded.count""",
+                    [key + (count,) for key, count in counts.items()],
+                )
+            conn.execute("DELETE FROM bounces WHERE id BETWEEN ? AND ? AND date < ?",
+                         (rows[0]["id"], rows[-1]["id"], cutoff))
+        archived += len(rows)
+
+    conn.close()
+    vacuum(config["RETENTION_VACUUM_PAGES"])
+    return archived
+
+
+def vacuum(pages=0):
+    """Release up to `pages` free pages (0 = all); switches the DB to
+    incremental auto-vacuum once"""
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # auto_vacuum only changes on a full VACUUM; needed a single time
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # 0 = whole freelist. executescript steps the pragma to completion;
+        # execute() would free a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({max(pages, 0)});")
+    conn.close()
+
+
+# ============================================
+# Reading the archive
+# ============================================
+
+def archived_months(config=None):
+    """Sorted list of (month, path, format) found in ARCHIVE_DIR"""
+    config = config or load_config()
+    found = []
+    for path in glob.glob(os.path.join(config["ARCHIVE_DIR"], "bounces-*.*")):
+        name = os.path.basename(path)
+        month = name[len("bounces-"):len("bounces-") + 7]
+        if name.endswith(".ndjson.gz"):
+            found.append((month, path, "ndjson"))
+        elif name.endswith(".db"):
+            found.append((month, path, "sqlite"))
+    return sorted(found)
+
+
+def months_in_range(filters, config=None):
+    """Archives whose month overlaps date_from..date_to"""
+    date_from = filters.get("date_from") or ""
+    date_to = end_of_day(filters["date_to"]) if filters.get("date_to") else ""
+    return [(month, path, fmt) for month, path, fmt in archived_months(config)
+            if not (date_from and month < date_from[:7])
+            and not (date_to and month > date_to[:7])]
+
+
+def archived_bounces(filters, config=None):
+    """Yield archived rows matching filters, oldest month first.
+
+    Only archives whose month overlaps date_from..date_to are opened.
+    """
+    for month, path, fmt in months_in_range(filters, config):
+        if fmt == "ndjson":
+            yield from ndjson_rows(path, filters)
+            continue
+
+        clause, params = filter_clause(filters)
+        # May be consumed across threads (streaming exports)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute("SELECT * FROM bounces WHERE 1=1" + clause + " ORDER BY id", params):
+                yield dict(row)
+        finally:
+            conn.close()
+
+
+def ndjson_rows(path, filters):
+    """Rows of one ndjson archive matching filters"""
+    date_from = filters.get("date_from") or ""
+    date_to = end_of_day(filters["date_to"]) if filters.get("date_to") else ""
+
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        seen = set()
+        for line in fh:
+            row = json.loads(line)
+            # Appends are not idempotent: a batch re-archived after a
+            # crash appears twice in the file
+            if row["id"] in seen:
+                continue
+            seen.add(row["id"])
+            if any(col in filters and row.get(col) != filters[col]
+                   for col in ("status", "domain", "account")):
+                continue
+            if date_from and row["date"] < date_from:
+                continue
+            if date_to and row["date"] > date_to:
+                continue
+            yield row
+
+
+def count_archived(filters, config=None):
+    """Number of archived rows matching filters (COUNT(*) per sqlite month)"""
+    total = 0
+    clause, params = filter_clause(filters)
+    for month, path, fmt in months_in_range(filters, config):
+        if fmt == "ndjson":
+            total += sum(1 for _ in ndjson_rows(path, filters))
+            continue
+        conn = sqlite3.connect(path)
+        total += conn.execute("SELECT COUNT(*) FROM bounces WHERE 1=1" + clause, params).fetchone()[0]
+        conn.close()
+    return total
+
+
+if __name__ == "__main__":
+    print(f"Archived {archive_old_bounces()} rows")
@@ -2,19 +2,9 @@ import os
 import smtplib
 import sqlite3
 from email.mime.text import MIMEText
-from dotenv import load_dotenv
+from config import load_config
 from db import get_connection
 
-# ============================================
-# Load environment
-# ============================================
-load_dotenv("data/.env")
-
-SMTP_SERVER = os.getenv("SMTP_SERVER", "localhost")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
-SMTP_USER = os.getenv("SMTP_USER", "")
-SMTP_PASS = os.getenv("SMTP_PASS", "")
-
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
 
@@ -23,7 +13,8 @@ DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 # ============================================
 
 def debug(msg: str):
-    if DEBUG:
+    # DEBUG may be switched in .env, which load_config() reloads each run
+    if DEBUG or os.getenv("DEBUG", "false").lower() == "true":
         print(f"[DEBUG] {msg}")
 
 
@@ -51,7 +42,12 @@ def init_queue():
 # Main retry logic
 # ============================================
 
-def process_retry_queue():
+def process_retry_queue(config=None, connections=None):
+    # SMTP settings are re-read from .env each run unless config is given
+    config = config or load_config()
+    smtp_server, smtp_port = config["SMTP_SERVER"], config["SMTP_PORT"]
+    smtp_user, smtp_pass = config["SMTP_USER"], config["SMTP_PASS"]
+
     init_queue()
     conn = get_connection()
     cur = conn.cursor()
@@ -78,20 +74,24 @@ def process_retry_queue():
         try:
             msg = MIMEText(body)
             msg["Subject"] = subject
-            msg["From"] = SMTP_USER or "noreply@example.com"
+            msg["From"] = smtp_user or "noreply@example.com"
             msg["To"] = to_addr
             if cc_addr:
                 msg["Cc"] = cc_addr
 
             recipients = [to_addr] + ([cc_addr] if cc_addr else [])
 
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                if SMTP_USER and SMTP_PASS:
-                    debug("Authenticating to SMTP relay")
-                    server.starttls()
-                    server.login(SMTP_USER, SMTP_PASS)
-
-                server.sendmail(msg["From"], recipients, msg.as_string())
+            if connections is not None:
+                connections.sendmail(smtp_server, smtp_port, smtp_user, smtp_pass,
+                                     msg["From"], recipients, msg.as_string())
+            else:
+                with smtplib.SMTP(smtp_server, smtp_port) as server:
+                    if smtp_user and smtp_pass:
+                        debug("Authenticating to SMTP relay")
+                        server.starttls()
+                        server.login(smtp_user, smtp_pass)
+
+                    server.sendmail(msg["From"], recipients, msg.as_string())
 
             debug(f"Successfully sent retry message {msg_id} → {to_addr}")
 
@@ -0,0 +1,223 @@
+"""
+In-process job scheduler (run under supervisord).
+- Runs bounce checks, retry drains, the daily summary and retention
+  (archiving old bounces) as jobs.
+- Single-flight: a job is skipped if it is still running, here or in
+  another process (see locks.py).
+- Random jitter on every run; SCHEDULER_ENABLED is re-read from .env
+  so the web UI toggle takes effect without a restart.
+- IMAP and SMTP connections stay logged in between runs.
+"""
+
+import sys
+import time
+import random
+import signal
+import smtplib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from config import load_config
+from db import init_db
+from locks import job_lock
+from imap_client import connect_imap
+from process_bounces import process_mailbox
+from retry_queue import process_retry_queue
+from daily_summary import send_summary
+from retention import archive_old_bounces
+
+logger = logging.getLogger("scheduler")
+
+# How often the schedule and the .env toggles are checked
+TICK_SECONDS = 5
+
+
+class WarmConnections:
+    """IMAP/SMTP connections kept open across job runs"""
+
+    def __init__(self):
+        self._imap = {}
+        self._smtp = {}
+        self._smtp_lock = threading.Lock()
+
+    @staticmethod
+    def _imap_key(account):
+        return (account["NAME"], account["IMAP_SERVER"], account["IMAP_PORT"], account["IMAP_USER"])
+
+    def imap(self, account):
+        """Logged-in IMAP connection for the account, reconnecting if stale"""
+        key = self._imap_key(account)
+        mail = self._imap.get(key)
+        if mail is not None:
+            try:
+                if mail.noop()[0] == "OK":
+                    return mail
+            except Exception:
+                pass
+            self.discard_imap(account)
+        mail = connect_imap(account)
+        self._imap[key] = mail
+        return mail
+
+    def discard_imap(self, account):
+        mail = self._imap.pop(self._imap_key(account), None)
+        if mail is not None:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+
+    def sendmail(self, host, port, user, password, from_addr, recipients, message):
+        """Send over a shared SMTP connection (serialized between jobs)"""
+        key = (host, port, user)
+        with self._smtp_lock:
+            for attempt in (1, 2):
+                server = self._smtp.get(key)
+                if server is None:
+                    server = smtplib.SMTP(host, port, timeout=60)
+                    if user and password:
+                        server.starttls()
+                        server.login(user, password)
+                    self._smtp[key] = server
+                try:
+                    return server.sendmail(from_addr, recipients, message)
+                except smtplib.SMTPServerDisconnected:
+                    # Idle connection closed by the relay: reconnect once
+                    self._smtp.pop(key, None)
+                    if attempt == 2:
+                        raise
+                except smtplib.SMTPResponseException:
+                    server.rset()
+                    raise
+                except Exception:
+                    self._close_smtp(self._smtp.pop(key, None))
+                    raise
+
+    @staticmethod
+    def _close_smtp(server):
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+    def close(self):
+        for key in list(self._imap):
+            mail = self._imap.pop(key)
+            try:
+                mail.logout()
+            except Exception:
+                pass
+        with self._smtp_lock:
+            for key in list(self._smtp):
+                self._close_smtp(self._smtp.pop(key))
+
+
+class Job:
+    """A scheduled job: every `interval` seconds, or daily at `at` (HH:MM UTC)"""
+
+    def __init__(self, name, func, interval=None, at=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+        self.next_run = None
+        self.thread = None
+
+    def schedule_next(self, now, jitter, first=False):
+        if self.interval:
+            base = now if first else now + self.interval
+        else:
+            hour, minute = (int(x) for x in self.at.split(":"))
+            current = datetime.fromtimestamp(now, timezone.utc)
+            target = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if target <= current:
+                target += timedelta(days=1)
+            base = target.timestamp()
+        self.next_run = base + random.uniform(0, jitter)
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class Scheduler:
+    def __init__(self, jobs, jitter, connections=None):
+        self.jobs = jobs
+        self.jitter = jitter
+        self.connections = connections
+        self.enabled = None
+        now = time.time()
+        for job in self.jobs:
+            job.schedule_next(now, jitter, first=True)
+
+    def tick(self, now, enabled):
+        """Start every job that is due; returns the jobs started"""
+        if enabled != self.enabled:
+            logger.info(f"Scheduler {'enabled' if enabled else 'disabled'}")
+            self.enabled = enabled
+
+        started = []
+        for job in self.jobs:
+            if job.next_run > now:
+                continue
+            # Next slot counts from now, so an overrun never queues up runs
+            job.schedule_next(now, self.jitter)
+            if not enabled:
+                continue
+            if job.running():
+                logger.info(f"Skipping {job.name}: previous run still in progress")
+                continue
+            job.thread = threading.Thread(target=self._run, args=(job,), name=job.name, daemon=True)
+            job.thread.start()
+            started.append(job)
+        return started
+
+    def _run(self, job):
+        with job_lock(job.name) as acquired:
+            if not acquired:
+                logger.info(f"Skipping {job.name}: already running in another process")
+                return
+            logger.info(f"Running {job.name}")
+            started = time.monotonic()
+            try:
+                job.func(self.connections)
+            except Exception as e:
+                logger.error(f"Job {job.name} failed: {e}")
+            logger.info(f"Finished {job.name} in {time.monotonic() - started:.1f}s")
+
+
+def build_jobs(config):
+    return [
+        Job("bounces", lambda c: process_mailbox(connections=c), interval=config["SCHEDULE_BOUNCES_SECONDS"]),
+        # .env is re-read on every run (test mode, SMTP and recipient changes)
+        Job("retry", lambda c: process_retry_queue(load_config(), connections=c),
+            interval=config["SCHEDULE_RETRY_SECONDS"]),
+        Job("summary", lambda c: send_summary(load_config(), connections=c), at=config["SCHEDULE_SUMMARY_AT"]),
+        Job("retention", lambda c: archive_old_bounces(load_config()), at=config["SCHEDULE_RETENTION_AT"]),
+    ]
+
+
+def main():
+    # Let supervisord's SIGTERM unwind through the finally block
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    config = load_config()
+    init_db()
+    connections = WarmConnections()
+    scheduler = Scheduler(build_jobs(config), config["SCHEDULER_JITTER_SECONDS"], connections)
+    logger.info("Scheduler started: " + ", ".join(
+        f"{job.name} ({f'every {job.interval}s' if job.interval else f'daily at {job.at} UTC'})"
+        for job in scheduler.jobs))
+
+    try:
+        while True:
+            config = load_config()  # picks up the SCHEDULER_ENABLED toggle
+            scheduler.tick(time.time(), config["SCHEDULER_ENABLED"])
+            time.sleep(TICK_SECONDS)
+    finally:
+        connections.close()
+
+
+if __name__ == "__main__":
+    main()
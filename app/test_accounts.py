@@ -0,0 +1,143 @@
+import pytest
+
+import config
+import db
+import process_bounces
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    """Environment-only config: no .env file, no inherited IMAP_* settings"""
+    monkeypatch.setattr(config, "ENV_FILE", str(tmp_path / "missing.env"))
+    for key in ("IMAP_ACCOUNTS", "IMAP_SECURE", "IMAP_PORT", "IMAP_TEST_MODE", "IMAP_ENGINE"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setenv("IMAP_SERVER", "imap.example.com")
+    monkeypatch.setenv("IMAP_USER", "bounces@example.com")
+    monkeypatch.setenv("IMAP_PASS", "secret")
+    monkeypatch.setenv("IMAP_FOLDER_PROCESSED", "Done")
+    return monkeypatch
+
+
+def test_single_default_account_without_imap_accounts(env):
+    accounts = config.load_config()["IMAP_ACCOUNTS"]
+    assert [a["NAME"] for a in accounts] == ["default"]
+    assert accounts[0]["IMAP_SERVER"] == "imap.example.com"
+    assert accounts[0]["IMAP_PORT"] == 143
+    assert accounts[0]["IMAP_FOLDER_PROCESSED"] == "Done"
+
+
+def test_accounts_inherit_globals_and_apply_overrides(env):
+    env.setenv("IMAP_ACCOUNTS", " billing, support ,")
+    env.setenv("IMAP_BILLING_USER", "billing@example.com")
+    env.setenv("IMAP_BILLING_FOLDER_INBOX", "Bounces")
+    env.setenv("IMAP_SUPPORT_SERVER", "imap.support.example.com")
+    env.setenv("IMAP_SUPPORT_PORT", "993")
+    env.setenv("IMAP_SUPPORT_SECURE", "SSL")
+
+    billing, support = config.load_config()["IMAP_ACCOUNTS"]
+
+    assert billing["NAME"] == "billing"
+    assert billing["IMAP_USER"] == "billing@example.com"
+    assert billing["IMAP_FOLDER_INBOX"] == "Bounces"
+    assert billing["IMAP_SERVER"] == "imap.example.com"      # inherited
+    assert billing["IMAP_PASS"] == "secret"                  # inherited
+    assert billing["IMAP_FOLDER_PROCESSED"] == "Done"        # inherited
+
+    assert support["IMAP_SERVER"] == "imap.support.example.com"
+    assert support["IMAP_USER"] == "bounces@example.com"
+    # Overrides are normalised like the global settings
+    assert support["IMAP_PORT"] == 993
+    assert support["IMAP_SECURE"] == "ssl"
+
+
+def test_connection_slots_are_shared_per_server_and_user(monkeypatch):
+    monkeypatch.setattr(process_bounces, "_CONNECTION_SLOTS", {})
+    cfg = {"IMAP_MAX_CONNECTIONS": 2}
+    a = {"IMAP_SERVER": "s", "IMAP_PORT": 993, "IMAP_USER": "u"}
+    b = dict(a, NAME="other-name-same-login")
+    c = dict(a, IMAP_USER="v")
+
+    slot = process_bounces.connection_slot(cfg, a)
+    assert process_bounces.connection_slot(cfg, b) is slot
+    assert process_bounces.connection_slot(cfg, c) is not slot
+
+    assert slot.acquire(blocking=False) and slot.acquire(blocking=False)
+    assert not slot.acquire(blocking=False)
+
+
+def dsn(recipient):
+    return (
+        "From: MAILER-DAEMON@mx.example.com\r\n"
+        "To: sender@example.com\r\n"
+        "Subject: Undelivered Mail Returned to Sender\r\n"
+        'Content-Type: multipart/report; report-type=delivery-status; boundary="b"\r\n'
+        "\r\n"
+        "--b\r\n"
+        "Content-Type: text/plain\r\n"
+        "\r\n"
+        f"550 5.1.1 <{recipient}>: Recipient address rejected\r\n"
+        "--b\r\n"
+        "Content-Type: message/delivery-status\r\n"
+        "\r\n"
+        "Reporting-MTA: dns; mx.example.com\r\n"
+        "\r\n"
+        f"Final-Recipient: rfc822; {recipient}\r\n"
+        "Action: failed\r\n"
+        "Status: 5.1.1\r\n"
+        "--b--\r\n"
+    ).encode()
+
+
+class FakeIMAP:
+    def __init__(self, messages):
+        self.messages = messages
+        self.moved = []
+        self.logged_out = False
+
+    def select(self, folder):
+        self.folder = folder
+        return "OK", [str(len(self.messages)).encode()]
+
+    def search(self, charset, criteria):
+        return "OK", [b" ".join(str(i + 1).encode() for i in range(len(self.messages)))]
+
+    def fetch(self, num, parts):
+        return "OK", [(num + b" (RFC822)", self.messages[int(num) - 1])]
+
+    def copy(self, num, folder):
+        self.moved.append((num, folder))
+
+    def store(self, num, flags, value):
+        pass
+
+    def expunge(self):
+        pass
+
+    def logout(self):
+        self.logged_out = True
+
+
+def test_each_account_is_processed_and_tagged(env, tmp_db, monkeypatch):
+    env.setenv("IMAP_ACCOUNTS", "billing,support")
+    env.setenv("IMAP_BILLING_USER", "billing@example.com")
+    env.setenv("IMAP_SUPPORT_USER", "support@example.com")
+    env.setenv("IMAP_SUPPORT_FOLDER_PROCESSED", "SupportDone")
+
+    mailboxes = {
+        "billing@example.com": FakeIMAP([dsn("a@x.com"), dsn("b@x.com")]),
+        "support@example.com": FakeIMAP([dsn("c@y.com")]),
+    }
+    monkeypatch.setattr(process_bounces, "connect_imap", lambda account: mailboxes[account["IMAP_USER"]])
+    monkeypatch.setattr(process_bounces, "send_notification", lambda *args, **kwargs: None)
+
+    process_bounces.process_mailbox()
+
+    rows = db.query_bounces({})
+    assert sorted((r["account"], r["email_to"]) for r in rows) == [
+        ("billing", "sender@example.com"), ("billing", "sender@example.com"),
+        ("support", "sender@example.com")]
+    assert db.count_bounces({"account": "billing"}) == 2
+
+    assert mailboxes["billing@example.com"].moved == [(b"1", "Done"), (b"2", "Done")]
+    assert mailboxes["support@example.com"].moved == [(b"1", "SupportDone")]
+    assert all(m.logged_out for m in mailboxes.values())
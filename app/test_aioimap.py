@@ -0,0 +1,402 @@
+import re
+import ssl
+import shutil
+import asyncio
+import subprocess
+
+import pytest
+
+import process_bounces
+from aioimap import AsyncIMAP4, IMAPError, LiteralTooLarge
+
+BOUNCE = (
+    b"To: someone@example.com\r\n"
+    b"Subject: Undelivered Mail Returned to Sender\r\n"
+    b"\r\n"
+    b"550 5.1.1 <user@nowhere.com>: User unknown\r\n"
+)
+PLAIN = b"To: someone@example.com\r\nSubject: Hello\r\n\r\nJust saying hi\r\n"
+
+
+class IMAPStandIn:
+    """Tiny in-memory IMAP server; commands are answered concurrently
+    (with a small delay) so pipelined requests actually overlap."""
+
+    def __init__(self, folders, delay=0.01, ssl_context=None, starttls=False):
+        self.folders = folders
+        self.delay = delay
+        self.ssl_context = ssl_context
+        self.starttls = starttls  # False: TLS from the first byte when ssl_context is set
+        self.login_over_tls = None
+        self.selected = None
+        self.deleted = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.commands = []
+        self.server = None
+
+    async def start(self):
+        tls = None if self.starttls else self.ssl_context
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0, ssl=tls)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        writer.write(b"* OK IMAP stand-in ready\r\n")
+        await writer.drain()
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            tag, name, *args = re.findall(rb'"(?:[^"\\]|\\.)*"|\(.*?\)|\S+', line.strip())
+            self.commands.append(name.decode())
+            if name == b"STARTTLS":
+                # Answered inline: the handshake must follow the OK directly
+                writer.write(tag + b" OK Begin TLS negotiation now\r\n")
+                await writer.drain()
+                await writer.start_tls(self.ssl_context)
+                continue
+            if name == b"LOGIN":
+                self.login_over_tls = writer.get_extra_info("ssl_object") is not None
+            tasks.append(asyncio.create_task(self.answer(writer, tag, name.decode(), args)))
+            if name == b"LOGOUT":
+                break
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def answer(self, writer, tag, name, args):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+        args = [a.strip(b'"').decode() for a in args]
+        out = []
+        status = b"OK"
+        if name == "LOGIN":
+            if args[1] != "secret":
+                status = b"NO"
+        elif name == "SELECT":
+            self.selected = args[0]
+            out.append(b"* %d EXISTS\r\n" % len(self.folders[self.selected]))
+        elif name == "SEARCH":
+            nums = " ".join(str(i + 1) for i in range(len(self.folders[self.selected])))
+            out.append(b"* SEARCH " + nums.encode() + b"\r\n")
+        elif name == "FETCH":
+            num = int(args[0])
+            body = self.folders[self.selected][num - 1]
+            out.append(b"* %d FETCH (RFC822 {%d}\r\n" % (num, len(body)) + body + b")\r\n")
+        elif name == "COPY":
+            num = int(args[0])
+            self.folders.setdefault(args[1], []).append(self.folders[self.selected][num - 1])
+        elif name == "STORE":
+            num = int(args[0])
+            self.deleted.add(num)
+            if not args[1].upper().endswith(".SILENT"):
+                out.append(b"* %d FETCH (FLAGS (\\Deleted))\r\n" % num)
+        elif name == "EXPUNGE":
+            for num in sorted(self.deleted, reverse=True):
+                del self.folders[self.selected][num - 1]
+                out.append(b"* %d EXPUNGE\r\n" % num)
+            self.deleted.clear()
+        elif name == "LOGOUT":
+            out.append(b"* BYE logging out\r\n")
+        writer.write(b"".join(out) + tag + b" " + status + b" " + name.encode() + b" done\r\n")
+        await writer.drain()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def standin_account(port):
+    return {
+        "NAME": "standin",
+        "IMAP_SERVER": "127.0.0.1", "IMAP_PORT": port, "IMAP_SECURE": "none",
+        "IMAP_USER": "user", "IMAP_PASS": "secret",
+        "IMAP_FOLDER_INBOX": "INBOX", "IMAP_FOLDER_PROCESSED": "PROCESSED",
+        "IMAP_FOLDER_PROBLEM": "PROBLEM", "IMAP_FOLDER_SKIPPED": "SKIPPED",
+    }
+
+
+def standin_config(parse_mode="stream"):
+    return {"IMAP_TEST_MODE": False, "IMAP_PIPELINE_DEPTH": 4,
+            "PARSE_MODE": parse_mode, "MESSAGE_MAX_BYTES": 1024, "PART_MAX_BYTES": 512}
+
+
+def test_pipelined_fetches_return_matching_literals():
+    async def scenario():
+        stand_in = IMAPStandIn({"INBOX": [b"first\r\n", b"second message\r\n", b"third\r\n"]})
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port).connect()
+            await mail.login("user", "secret")
+            typ, data = await mail.select("INBOX")
+            assert (typ, data) == ("OK", [b"3"])
+
+            results = await asyncio.gather(*(mail.fetch(str(n), "(RFC822)") for n in (3, 1, 2)))
+            await mail.logout()
+        finally:
+            await stand_in.stop()
+        return stand_in, results
+
+    stand_in, results = run(scenario())
+    assert [data[0][1] for _, data in results] == [b"third\r\n", b"first\r\n", b"second message\r\n"]
+    assert results[0][1][0][0] == b"3 (RFC822 {7}"
+    assert stand_in.max_in_flight == 3
+
+
+def test_store_flags_reply_does_not_reach_pipelined_fetches():
+    class SlowFetches(IMAPStandIn):
+        async def answer(self, writer, tag, name, args):
+            # STORE's FLAGS reply arrives while both fetches are in flight
+            if name == "FETCH":
+                await asyncio.sleep(0.1)
+            await super().answer(writer, tag, name, args)
+
+    async def scenario():
+        stand_in = SlowFetches({"INBOX": [b"first\r\n", b"second\r\n", b"third\r\n"]})
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port).connect()
+            await mail.login("user", "secret")
+            await mail.select("INBOX")
+            results = await asyncio.gather(
+                mail.fetch("2", "(RFC822)"),
+                mail.fetch("3", "(RFC822)"),
+                mail.store("1", "+FLAGS", "\\Deleted"),
+            )
+            await mail.logout()
+        finally:
+            await stand_in.stop()
+        return results
+
+    second, third, store = run(scenario())
+    assert second[1][0][1] == b"second\r\n"
+    assert third[1][0][1] == b"third\r\n"
+    assert store == ("OK", [b"1 (FLAGS (\\Deleted))"])
+
+
+def test_login_failure_raises():
+    async def scenario():
+        stand_in = IMAPStandIn({"INBOX": []})
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port).connect()
+            try:
+                await mail.login("user", "wrong")
+            finally:
+                await mail.close()
+        finally:
+            await stand_in.stop()
+
+    with pytest.raises(IMAPError):
+        run(scenario())
+
+
+def test_oversized_literal_fails_only_its_fetch():
+    async def scenario():
+        stand_in = IMAPStandIn({"INBOX": [b"x" * 4096, b"small\r\n"]})
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port, chunk_size=512, max_literal=1024).connect()
+            await mail.login("user", "secret")
+            await mail.select("INBOX")
+            results = await asyncio.gather(mail.fetch("1", "(RFC822)"), mail.fetch("2", "(RFC822)"),
+                                           return_exceptions=True)
+            results.append(await mail.noop())
+            await mail.logout()
+        finally:
+            await stand_in.stop()
+        return results
+
+    oversized, small, noop = run(scenario())
+    assert isinstance(oversized, LiteralTooLarge)
+    assert "exceeds limit" in str(oversized)
+    assert small[1][0][1] == b"small\r\n"
+    assert noop[0] == "OK"
+
+
+def test_timeout_counts_inactivity_not_time_in_queue():
+    class TrickleFirstFetch(IMAPStandIn):
+        """Sends message 1 in slow pieces; later replies wait behind it"""
+
+        def __init__(self, folders):
+            super().__init__(folders)
+            self.lock = asyncio.Lock()
+
+        async def answer(self, writer, tag, name, args):
+            if name != "FETCH":
+                return await super().answer(writer, tag, name, args)
+            async with self.lock:
+                if args[0] != b"1":
+                    return await super().answer(writer, tag, name, args)
+                body = self.folders[self.selected][0]
+                writer.write(b"* 1 FETCH (RFC822 {%d}\r\n" % len(body))
+                for i in range(0, len(body), 10):
+                    writer.write(body[i:i + 10])
+                    await writer.drain()
+                    await asyncio.sleep(0.05)
+                writer.write(b")\r\n" + tag + b" OK FETCH done\r\n")
+                await writer.drain()
+
+    async def scenario():
+        stand_in = TrickleFirstFetch({"INBOX": [b"y" * 100, b"second\r\n", b"third\r\n"]})
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port, timeout=0.3).connect()
+            await mail.login("user", "secret")
+            await mail.select("INBOX")
+            # Message 1 takes ~0.5s to arrive; 2 and 3 are queued behind it
+            results = await asyncio.gather(*(mail.fetch(str(n), "(RFC822)") for n in (1, 2, 3)))
+            await mail.logout()
+        finally:
+            await stand_in.stop()
+        return results
+
+    results = run(scenario())
+    assert [data[0][1] for _, data in results] == [b"y" * 100, b"second\r\n", b"third\r\n"]
+
+
+def test_process_account_async_routes_messages(monkeypatch):
+    folders = {"INBOX": [BOUNCE, PLAIN, BOUNCE]}
+    handled = []
+
+    def fake_handle_message(config, account, msg):
+        handled.append(msg["Subject"])
+        return process_bounces.classify_bounce(msg)[0]
+
+    monkeypatch.setattr(process_bounces, "handle_message", fake_handle_message)
+
+    async def scenario():
+        stand_in = IMAPStandIn(folders)
+        port = await stand_in.start()
+        try:
+            await process_bounces.process_account_async(standin_config(), standin_account(port))
+        finally:
+            await stand_in.stop()
+        return stand_in
+
+    stand_in = run(scenario())
+    assert len(handled) == 3
+    assert folders["INBOX"] == []
+    assert folders["PROCESSED"] == [BOUNCE, BOUNCE]
+    assert folders["SKIPPED"] == [PLAIN]
+    assert stand_in.commands[-2:] == ["EXPUNGE", "LOGOUT"]
+
+
+def test_full_mode_moves_oversized_message_to_problem(monkeypatch):
+    oversized = BOUNCE + b"x" * 4096
+    folders = {"INBOX": [oversized, BOUNCE]}
+    handled = []
+
+    def fake_handle_message(config, account, msg):
+        handled.append(msg["Subject"])
+        return process_bounces.classify_bounce(msg)[0]
+
+    monkeypatch.setattr(process_bounces, "handle_message", fake_handle_message)
+
+    async def scenario():
+        stand_in = IMAPStandIn(folders)
+        port = await stand_in.start()
+        try:
+            await process_bounces.process_account_async(standin_config("full"), standin_account(port))
+        finally:
+            await stand_in.stop()
+
+    run(scenario())
+    assert len(handled) == 1
+    assert folders["INBOX"] == []
+    assert folders["PROBLEM"] == [oversized]
+    assert folders["PROCESSED"] == [BOUNCE]
+
+
+@pytest.fixture(scope="module")
+def self_signed(tmp_path_factory):
+    """(server context, client context trusting it) for 127.0.0.1"""
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available")
+    path = tmp_path_factory.mktemp("tls")
+    cert, key = path / "cert.pem", path / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    server = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server.load_cert_chain(cert, key)
+    return server, ssl.create_default_context(cafile=str(cert))
+
+
+@pytest.mark.parametrize("secure", ["ssl", "starttls"])
+def test_tls_modes_match_imaplib(self_signed, secure):
+    server_ctx, client_ctx = self_signed
+
+    async def scenario():
+        stand_in = IMAPStandIn({"INBOX": [BOUNCE]}, ssl_context=server_ctx, starttls=secure == "starttls")
+        port = await stand_in.start()
+        try:
+            mail = await AsyncIMAP4("127.0.0.1", port, secure=secure, ssl_context=client_ctx).connect()
+            await mail.login("user", "secret")
+            await mail.select("INBOX")
+            typ, data = await mail.fetch("1", "(RFC822)")
+            await mail.logout()
+            await mail.close()
+        finally:
+            await stand_in.stop()
+        return stand_in, data
+
+    stand_in, data = run(scenario())
+    assert data[0][1] == BOUNCE
+    assert stand_in.login_over_tls is True
+    assert ("STARTTLS" in stand_in.commands) == (secure == "starttls")
+
+
+def test_default_context_rejects_untrusted_certificate(self_signed):
+    server_ctx, _ = self_signed
+
+    async def scenario():
+        stand_in = IMAPStandIn({"INBOX": []}, ssl_context=server_ctx, starttls=True)
+        port = await stand_in.start()
+        try:
+            await AsyncIMAP4("127.0.0.1", port, secure="starttls").connect()
+        finally:
+            await stand_in.stop()
+
+    with pytest.raises(ssl.SSLCertVerificationError):
+        run(scenario())
+
+
+def test_failed_message_cancels_outstanding_fetches(monkeypatch):
+    folders = {"INBOX": [BOUNCE, PLAIN, BOUNCE, PLAIN]}
+
+    def broken_handle_message(config, account, msg):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(process_bounces, "handle_message", broken_handle_message)
+
+    class SlowLaterFetches(IMAPStandIn):
+        async def answer(self, writer, tag, name, args):
+            # Messages 2-4 are still in flight when message 1 fails
+            if name == "FETCH" and args[0] != b"1":
+                await asyncio.sleep(0.3)
+            await super().answer(writer, tag, name, args)
+
+    async def scenario():
+        stand_in = SlowLaterFetches(folders)
+        port = await stand_in.start()
+        try:
+            await process_bounces.process_account_async(standin_config(), standin_account(port))
+            return [t for t in asyncio.all_tasks() if t.get_coro().__qualname__.endswith(".fetch")]
+        finally:
+            await stand_in.stop()
+
+    assert run(scenario()) == []
+    # Nothing was handled, so nothing moved or expunged
+    assert len(folders["INBOX"]) == 4
+    assert "PROCESSED" not in folders
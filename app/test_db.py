@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+
+def test_iter_bounces_chunks_across_threads(tmp_db):
+    for i in range(25):
+        db.insert_bounce(f"u{i}@x.com", "", "failed" if i % 5 else "unknown", "", "x.com")
+
+    chunks = db.iter_bounces({"status": "failed"}, chunk_size=7)
+    # StreamingResponse resumes sync generators on arbitrary pool threads
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        sizes = []
+        while True:
+            chunk = pool.submit(next, chunks, None).result()
+            if chunk is None:
+                break
+            sizes.append(len(chunk))
+
+    assert sizes == [7, 7, 6]
+
+
+def test_writers_are_not_blocked_by_a_half_read_export(tmp_db):
+    for i in range(10):
+        db.insert_bounce(f"u{i}@x.com", "", "failed", "", "x.com")
+
+    chunks = db.iter_bounces({}, chunk_size=3)
+    first = next(chunks)
+
+    writer = db.sqlite3.connect(tmp_db, timeout=0.1)
+    writer.execute("INSERT INTO bounces (email_to, status, domain) VALUES ('late@x.com', 'failed', 'x.com')")
+    writer.commit()
+    writer.close()
+
+    ids = [row["id"] for row in first] + [row["id"] for chunk in chunks for row in chunk]
+    assert ids == list(range(1, 12))
@@ -0,0 +1,116 @@
+import email
+
+import pytest
+
+import db
+import dedup
+import process_bounces
+
+
+def make_dsn(message_id="<original@example.com>", status="5.1.1", recipient="user@nowhere.com"):
+    return email.message_from_string(
+        "From: MAILER-DAEMON@mx.example.com\n"
+        "To: sender@example.com\n"
+        "Subject: Undelivered Mail Returned to Sender\n"
+        'Content-Type: multipart/report; report-type=delivery-status; boundary="b"\n'
+        "\n"
+        "--b\n"
+        "Content-Type: text/plain\n"
+        "\n"
+        f"550 {status} <{recipient}>: Recipient address rejected\n"
+        "--b\n"
+        "Content-Type: message/delivery-status\n"
+        "\n"
+        "Reporting-MTA: dns; mx.example.com\n"
+        "\n"
+        f"Final-Recipient: rfc822; {recipient}\n"
+        "Action: failed\n"
+        f"Status: {status}\n"
+        "--b\n"
+        "Content-Type: text/rfc822-headers\n"
+        "\n"
+        f"Message-ID: {message_id}\n"
+        "Subject: Hello\n"
+        "--b--\n"
+    )
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(dedup, "_index", None)
+
+
+def test_fingerprint_uses_message_id_recipient_and_status_class():
+    base = dedup.bounce_fingerprint(make_dsn(), "failed")
+    assert base == dedup.bounce_fingerprint(make_dsn(status="5.2.2"), "failed")
+    assert base != dedup.bounce_fingerprint(make_dsn(status="4.4.7"), "failed")
+    assert base != dedup.bounce_fingerprint(make_dsn(recipient="other@nowhere.com"), "failed")
+    assert base != dedup.bounce_fingerprint(make_dsn(message_id="<other@example.com>"), "failed")
+
+    plain = email.message_from_string("Subject: hi\n\nno headers quoted here\n")
+    assert dedup.bounce_fingerprint(plain, "unknown") is None
+
+
+def test_bounces_without_a_failed_recipient_are_not_fingerprinted():
+    # Non-DSN bounces quote the original message but name no recipient
+    # in a machine-readable form: each one must be recorded
+    for recipient in ("a@x.com", "b@y.com"):
+        msg = email.message_from_string(
+            "From: MAILER-DAEMON@mx.example.com\n"
+            "To: sender@example.com\n"
+            "Subject: failure notice\n"
+            "\n"
+            f"<{recipient}>: 550 no such user\n"
+            "\n"
+            "--- Below this line is a copy of the message.\n"
+            "Message-ID: <original@example.com>\n"
+        )
+        assert dedup.original_message_id(msg) == "<original@example.com>"
+        assert dedup.bounce_fingerprint(msg, "failed") is None
+
+
+def test_index_expires_and_survives_restart(tmp_db):
+    writes = []
+    index = dedup.FingerprintIndex(ttl=3600)
+    assert index.record_once("fp", writes.append, now=1000) is True
+    assert index.record_once("fp", writes.append, now=2000) is False
+
+    # A fresh process only has the table
+    assert dedup.FingerprintIndex(ttl=3600).record_once("fp", writes.append, now=3000) is False
+    assert dedup.FingerprintIndex(ttl=3600).record_once("fp", writes.append, now=5000) is True
+    assert len(writes) == 2
+
+    index.prune(now=10000)
+    conn = db.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM bounce_fingerprints").fetchone()[0] == 0
+    conn.close()
+
+
+def test_failed_insert_does_not_record_the_fingerprint(tmp_db, monkeypatch):
+    monkeypatch.setattr(process_bounces, "send_notification", lambda *args, **kwargs: None)
+    config = {"IMAP_TEST_MODE": True, "NOTIFY_CC_TEST": ["ops@example.com"], "DEDUP_TTL_HOURS": 72}
+    account = {"NAME": "default"}
+
+    def locked(*args, **kwargs):
+        raise db.sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(process_bounces, "insert_bounce", locked)
+    with pytest.raises(db.sqlite3.OperationalError):
+        process_bounces.handle_message(config, account, make_dsn())
+
+    # The message stays in the inbox and is recorded on the next run
+    monkeypatch.setattr(process_bounces, "insert_bounce", db.insert_bounce)
+    process_bounces.handle_message(config, account, make_dsn())
+    assert db.count_bounces({}) == 1
+
+
+def test_duplicate_dsn_is_not_recorded_or_notified(tmp_db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(process_bounces, "send_notification", lambda *args, **kwargs: sent.append(args))
+    config = {"IMAP_TEST_MODE": True, "NOTIFY_CC_TEST": ["ops@example.com"], "DEDUP_TTL_HOURS": 72}
+    account = {"NAME": "default"}
+
+    assert process_bounces.handle_message(config, account, make_dsn()) == "failed"
+    assert process_bounces.handle_message(config, account, make_dsn()) == "failed"
+    assert db.count_bounces({}) == 1
+    assert len(sent) == 1
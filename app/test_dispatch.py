@@ -0,0 +1,92 @@
+import pytest
+
+import db
+import dispatch
+import imap_client
+import locks
+import process_bounces
+import retry_queue
+
+
+@pytest.fixture
+def runs(tmp_db, tmp_path, monkeypatch):
+    """Record which full jobs dispatch.py starts"""
+    started = []
+    monkeypatch.setattr(locks, "LOCK_DIR", str(tmp_path))
+    monkeypatch.setattr(process_bounces, "process_mailbox", lambda: started.append("bounces"))
+    monkeypatch.setattr(retry_queue, "process_retry_queue", lambda: started.append("retry"))
+    return started
+
+
+def inboxes(monkeypatch, counts):
+    """Fake IMAP logins answering STATUS with the given message counts"""
+    accounts = [{"NAME": name, "IMAP_FOLDER_INBOX": "INBOX", "IMAP_FOLDER_TEST": "TEST"} for name in counts]
+
+    class FakeIMAP:
+        def __init__(self, count):
+            self.count = count
+
+        def status(self, mailbox, items):
+            return "OK", [f'{mailbox} (MESSAGES {self.count})'.encode()]
+
+        def logout(self):
+            pass
+
+    def fake_connect(account):
+        count = counts[account["NAME"]]
+        if isinstance(count, Exception):
+            raise count
+        return FakeIMAP(count)
+
+    monkeypatch.setattr(imap_client, "connect_imap", fake_connect)
+    monkeypatch.setattr(dispatch, "load_config", lambda: {"IMAP_TEST_MODE": False, "IMAP_ACCOUNTS": accounts})
+
+
+def test_bounces_skipped_when_every_inbox_is_empty(runs, monkeypatch):
+    inboxes(monkeypatch, {"billing": 0, "support": 0})
+    assert dispatch.main(["bounces"]) == 0
+    assert runs == []
+
+    inboxes(monkeypatch, {"billing": 0, "support": 3})
+    assert dispatch.pending_bounces(dispatch.load_config()) == 3
+    dispatch.main(["bounces"])
+    assert runs == ["bounces"]
+
+
+def test_failed_status_check_falls_through_to_full_run(runs, monkeypatch):
+    inboxes(monkeypatch, {"billing": 0, "support": OSError("connection refused")})
+    assert dispatch.pending_bounces(dispatch.load_config()) is None
+    dispatch.main(["bounces"])
+    assert runs == ["bounces"]
+
+
+def test_retry_skipped_when_queue_is_empty(runs):
+    # No retry_queue table yet counts as empty
+    dispatch.main(["retry"])
+    assert runs == []
+
+    retry_queue.init_queue()
+    dispatch.main(["retry"])
+    assert runs == []
+
+    conn = db.get_connection()
+    conn.execute("INSERT INTO retry_queue (email_to, subject, body) VALUES ('u@x.com', 's', 'b')")
+    conn.commit()
+    conn.close()
+    dispatch.main(["retry"])
+    assert runs == ["retry"]
+
+
+def test_force_skips_the_checks(runs, monkeypatch):
+    inboxes(monkeypatch, {"billing": 0})
+    dispatch.main(["bounces", "--force"])
+    dispatch.main(["retry", "--force"])
+    assert runs == ["bounces", "retry"]
+
+
+def test_locked_job_and_unknown_job(runs):
+    with locks.job_lock("retry") as acquired:
+        assert acquired
+        assert dispatch.main(["retry", "--force"]) == 0
+    assert runs == []
+    assert dispatch.main(["nope"]) == 2
@@ -0,0 +1,58 @@
+import asyncio
+
+import db
+from live_feed import LiveFeed, counter_deltas
+
+
+def add(n, domain="example.com", status="failed"):
+    for i in range(n):
+        db.insert_bounce(f"user{i}@{domain}", "", status, "550", domain)
+
+
+def test_subscribers_share_one_poller_and_catch_up(tmp_db):
+    add(3)
+
+    async def scenario():
+        feed = LiveFeed(poll_seconds=0.01, buffer_rows=4)
+
+        # Watermark as the dashboard would send it (newest row it loaded)
+        live = feed.subscribe(since=3, heartbeat=0.05)
+        behind = feed.subscribe(since=1, heartbeat=0.05)
+        # A watermark older than the buffer is served from the table
+        assert [row["id"] for row in await behind.__anext__()] == [2, 3]
+
+        await asyncio.to_thread(add, 6, "other.org")
+        first = await live.__anext__()
+        seen = [row["id"] for row in first]
+        while seen[-1] < 9:
+            seen += [row["id"] for row in await live.__anext__()]
+        assert seen == [4, 5, 6, 7, 8, 9]
+
+        # The buffer only holds the newest rows, the rest comes from the table
+        assert feed.floor == 5
+        behind_ids = []
+        while not behind_ids or behind_ids[-1] < 9:
+            behind_ids += [row["id"] for row in await behind.__anext__()]
+        assert behind_ids == [4, 5, 6, 7, 8, 9]
+
+        # No commits since: only heartbeats
+        assert await live.__anext__() == []
+        await live.aclose()
+        await behind.aclose()
+        assert feed.subscribers == 0
+        # The poller notices on its next tick and shuts down
+        for _ in range(100):
+            if feed._task is None:
+                break
+            await asyncio.sleep(0.01)
+        assert feed._task is None
+
+    asyncio.run(scenario())
+
+
+def test_counter_deltas():
+    rows = [{"domain": "a.com", "status": "failed"},
+            {"domain": "a.com", "status": "delayed"},
+            {"domain": "b.com", "status": "failed"}]
+    assert counter_deltas(rows) == {"domains": {"a.com": 2, "b.com": 1},
+                                    "statuses": {"failed": 2, "delayed": 1}}
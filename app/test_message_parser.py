@@ -0,0 +1,106 @@
+import base64
+import tracemalloc
+
+from bounce_rules import classify_bounce
+from message_parser import BoundedMessageParser, parse_message
+
+
+def make_bounce(attachment_bytes):
+    """Multipart/report DSN returning the original message with an attachment"""
+    attachment = base64.encodebytes(b"\0" * attachment_bytes)
+    return (
+        b"From: MAILER-DAEMON@mx.example.com\r\n"
+        b"To: sender@example.com\r\n"
+        b"Subject: Undelivered Mail Returned to Sender\r\n"
+        b"MIME-Version: 1.0\r\n"
+        b'Content-Type: multipart/report; report-type=delivery-status; boundary="outer"\r\n'
+        b"\r\n"
+        b"--outer\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"550 5.1.1 <user@nowhere.com>: Recipient address rejected\r\n"
+        b"--outer\r\n"
+        b"Content-Type: message/delivery-status\r\n"
+        b"\r\n"
+        b"Final-Recipient: rfc822; user@nowhere.com\r\n"
+        b"Action: failed\r\n"
+        b"Status: 5.1.1\r\n"
+        b"--outer\r\n"
+        b"Content-Type: message/rfc822\r\n"
+        b"\r\n"
+        b"Message-ID: <original@example.com>\r\n"
+        b"Subject: Quarterly report\r\n"
+        b'Content-Type: multipart/mixed; boundary="inner"\r\n'
+        b"\r\n"
+        b"--inner\r\n"
+        b"Content-Type: text/plain\r\n"
+        b"\r\n"
+        b"See attached.\r\n"
+        b"--inner\r\n"
+        b"Content-Type: application/octet-stream\r\n"
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"\r\n"
+        + attachment +
+        b"--inner--\r\n"
+        b"--outer--\r\n"
+    )
+
+
+def test_oversized_attachment_is_dropped_but_structure_kept():
+    raw = make_bounce(200 * 1024)
+    msg, truncated = parse_message(raw, "stream", max_message_bytes=64 * 1024, max_part_bytes=16 * 1024)
+
+    assert truncated > 200 * 1024
+    outer = msg.get_payload()
+    assert [part.get_content_type() for part in outer] == [
+        "text/plain", "message/delivery-status", "message/rfc822",
+    ]
+    original = outer[2].get_payload()[0]
+    assert original["Message-ID"] == "<original@example.com>"
+    inner = original.get_payload()
+    assert [part.get_content_type() for part in inner] == ["text/plain", "application/octet-stream"]
+    assert len(inner[1].get_payload()) <= 16 * 1024
+
+
+def test_stream_and_full_modes_classify_alike():
+    raw = make_bounce(4096)
+    full, _ = parse_message(raw, "full")
+    stream, truncated = parse_message(raw, "stream", max_message_bytes=1024 * 1024, max_part_bytes=1024 * 1024)
+
+    assert truncated == 0
+    assert classify_bounce(stream) == classify_bounce(full)
+    assert stream.as_bytes() == full.as_bytes()
+
+
+def test_chunk_boundaries_do_not_matter():
+    raw = make_bounce(8192)
+    parser = BoundedMessageParser(1024 * 1024, 1024 * 1024)
+    for i in range(0, len(raw), 7):
+        parser.write(raw[i:i + 7])
+    msg = parser.close()
+
+    assert msg.as_bytes() == parse_message(raw, "full")[0].as_bytes()
+
+
+def test_long_single_line_part_is_dropped_as_it_arrives():
+    head, tail = make_bounce(0).split(b"--inner--")
+    chunk = b"A" * 64 * 1024
+    parser = BoundedMessageParser(64 * 1024, 16 * 1024)
+    tracemalloc.start()
+    try:
+        parser.write(head)
+        # 8 MiB of base64 without a single line break
+        for _ in range(128):
+            parser.write(chunk)
+        parser.write(b"\r\n--inner--" + tail)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    msg = parser.close()
+
+    assert peak < 1024 * 1024
+    assert parser.truncated_bytes >= 128 * len(chunk)
+    original = msg.get_payload()[2].get_payload()[0]
+    assert [part.get_content_type() for part in original.get_payload()] == [
+        "text/plain", "application/octet-stream",
+    ]
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+import db
+import retention
+from config import load_config
+
+
+@pytest.fixture(params=["sqlite", "ndjson"])
+def store(tmp_db, tmp_path, monkeypatch, request):
+    # Read through load_config() on every call, like data/.env values
+    monkeypatch.setenv("ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setenv("ARCHIVE_FORMAT", request.param)
+    monkeypatch.setenv("RETENTION_DAYS", "0")
+
+    conn = db.get_connection()
+    rows = [
+        ("2020-01-05 10:00:00", "failed", "a.com", "billing"),
+        ("2020-01-20 10:00:00", "failed", "b.com", "billing"),
+        ("2020-02-01 00:00:00", "unknown", "a.com", "support"),
+    ]
+    conn.executemany("INSERT INTO bounces (date, status, domain, account) VALUES (?, ?, ?, ?)", rows)
+    conn.execute("INSERT INTO bounces (status, domain, account) VALUES ('failed', 'a.com', 'billing')")
+    conn.commit()
+    conn.close()
+    return tmp_path
+
+
+def test_old_rows_move_to_monthly_archives(store):
+    assert retention.archive_old_bounces(days=30) == 3
+    assert [m for m, _, _ in retention.archived_months()] == ["2020-01", "2020-02"]
+
+    # Only the recent row stays live; totals still cover everything
+    assert len(db.query_bounces({})) == 1
+    assert db.count_bounces({}) == 4
+    assert db.count_bounces({"domain": "a.com"}) == 3
+    assert db.query_bounces({"group_by": "domain"}) == [
+        {"domain": "a.com", "count": 3}, {"domain": "b.com", "count": 1}]
+
+    conn = db.get_connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.close()
+
+
+def test_date_range_reads_only_needed_archives(store):
+    retention.archive_old_bounces(days=30)
+    os.remove(retention.archive_path(load_config(), "2020-02"))
+
+    rows = db.query_bounces({"date_from": "2020-01-01", "date_to": "2020-01-31", "status": "failed"})
+    assert [r["date"] for r in rows] == ["2020-01-05 10:00:00", "2020-01-20 10:00:00"]
+    assert db.count_bounces({"date_from": "2020-01-10", "date_to": "2020-01-31"}) == 1
+
+
+def test_rerun_is_a_noop(store):
+    retention.archive_old_bounces(days=30)
+    assert retention.archive_old_bounces(days=30) == 0
+    assert retention.archive_old_bounces(days=0) == 0
+    assert db.count_bounces({}) == 4
+
+
+def test_settings_come_from_config_at_call_time(store, monkeypatch):
+    assert retention.archive_old_bounces() == 0
+
+    monkeypatch.setenv("RETENTION_DAYS", "30")
+    monkeypatch.setenv("ARCHIVE_DIR", str(store / "elsewhere"))
+    assert retention.archive_old_bounces(load_config()) == 3
+    assert sorted(os.listdir(store / "elsewhere"))[0].startswith("bounces-2020-01.")
+    assert db.count_bounces({"date_to": "2020-01-31"}) == 2
+
+
+def test_vacuum_releases_the_whole_freelist(tmp_db):
+    retention.vacuum()  # switches the database to incremental auto-vacuum
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO bounces (reason) VALUES (?)", [("x" * 2000,)] * 500)
+    conn.commit()
+    conn.execute("DELETE FROM bounces")
+    conn.commit()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 100
+
+    retention.vacuum(pages=10)
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    assert freelist > 0
+
+    retention.vacuum()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+
+def test_batch_archived_twice_is_read_once(store):
+    # Simulate a crash after writing the archive but before the delete
+    rows = db.query_bounces({"date_to": "2020-01-31"})
+    retention.write_archive(load_config(), "2020-01", rows)
+    retention.archive_old_bounces(days=30)
+
+    dates = [r["date"] for r in db.query_bounces({"date_from": "2020-01-01", "date_to": "2020-01-31"})]
+    assert dates == ["2020-01-05 10:00:00", "2020-01-20 10:00:00"]
+    assert db.count_bounces({"date_from": "2020-01-01", "date_to": "2020-01-31"}) == 2
+
+
+def test_date_to_only_queries_and_counts_agree(store):
+    retention.archive_old_bounces(days=30)
+
+    rows = db.query_bounces({"date_to": "2020-01-31"})
+    assert [r["date"] for r in rows] == ["2020-01-05 10:00:00", "2020-01-20 10:00:00"]
+    assert db.count_bounces({"date_to": "2020-01-31"}) == len(rows)
+    assert db.count_bounces({"date_to": "2020-02-28", "domain": "a.com"}) == 2
+    assert sum(len(chunk) for chunk in db.iter_bounces({"date_to": "2020-02-28"})) == 3
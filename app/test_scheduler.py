@@ -0,0 +1,133 @@
+import threading
+from datetime import datetime, timezone
+
+import db
+import locks
+import scheduler
+from scheduler import Job, Scheduler
+
+
+def at(text):
+    return datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc).timestamp()
+
+
+def test_interval_and_daily_schedules():
+    every = Job("bounces", None, interval=300)
+    every.schedule_next(at("2024-01-01 10:00"), jitter=0, first=True)
+    assert every.next_run == at("2024-01-01 10:00")
+    every.schedule_next(at("2024-01-01 10:00"), jitter=0)
+    assert every.next_run == at("2024-01-01 10:05")
+
+    daily = Job("summary", None, at="00:00")
+    daily.schedule_next(at("2024-01-01 10:00"), jitter=0)
+    assert daily.next_run == at("2024-01-02 00:00")
+
+    daily.schedule_next(at("2024-01-01 10:00"), jitter=30)
+    assert at("2024-01-02 00:00") <= daily.next_run <= at("2024-01-02 00:00") + 30
+
+
+def test_tick_skips_running_and_disabled_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(locks, "LOCK_DIR", str(tmp_path))
+    release = threading.Event()
+    runs = []
+
+    def slow(connections):
+        runs.append("run")
+        release.wait(5)
+
+    job = Job("bounces", slow, interval=60)
+    sched = Scheduler([job], jitter=0)
+
+    now = job.next_run
+    assert sched.tick(now, enabled=True) == [job]
+    # Due again, but the first run has not finished
+    assert sched.tick(now + 60, enabled=True) == []
+    release.set()
+    job.thread.join(5)
+
+    assert sched.tick(now + 120, enabled=False) == []
+    assert job.next_run == now + 180
+    assert runs == ["run"]
+
+
+def test_run_is_skipped_when_locked_elsewhere(tmp_path, monkeypatch):
+    monkeypatch.setattr(locks, "LOCK_DIR", str(tmp_path))
+    runs = []
+    job = Job("retry", lambda connections: runs.append("run"), interval=60)
+    sched = Scheduler([job], jitter=0)
+
+    with locks.job_lock("retry") as acquired:
+        assert acquired
+        sched._run(job)
+    assert runs == []
+
+    sched._run(job)
+    assert runs == ["run"]
+
+
+def test_warm_imap_connection_is_reused(monkeypatch):
+    connects = []
+
+    class FakeIMAP:
+        def noop(self):
+            return "OK", [b""]
+
+        def logout(self):
+            pass
+
+    def fake_connect(account):
+        connects.append(account["NAME"])
+        return FakeIMAP()
+
+    monkeypatch.setattr(scheduler, "connect_imap", fake_connect)
+    account = {"NAME": "a", "IMAP_SERVER": "s", "IMAP_PORT": 143, "IMAP_USER": "u"}
+    pool = scheduler.WarmConnections()
+
+    first = pool.imap(account)
+    assert pool.imap(account) is first
+    pool.discard_imap(account)
+    assert pool.imap(account) is not first
+    assert connects == ["a", "a"]
+
+
+def test_summary_and_retry_jobs_reread_env_each_run(tmp_db, tmp_path, monkeypatch):
+    import config
+    import daily_summary
+    import retry_queue
+
+    env = tmp_path / ".env"
+    monkeypatch.setattr(config, "ENV_FILE", str(env))
+    monkeypatch.setattr(daily_summary, "DB_PATH", tmp_db)
+    # load_dotenv(override=True) writes os.environ; restore it afterwards
+    for key in ("IMAP_TEST_MODE", "NOTIFY_CC", "NOTIFY_CC_TEST", "SMTP_SERVER"):
+        monkeypatch.setenv(key, "")
+
+    retry_queue.init_queue()
+    conn = db.get_connection()
+    conn.execute("INSERT INTO retry_queue (email_to, subject, body) VALUES ('u@x.com', 's', 'b')")
+    conn.commit()
+    conn.close()
+
+    sent = []
+
+    class FakeConnections:
+        def sendmail(self, host, port, user, password, from_addr, recipients, message):
+            sent.append((host, recipients))
+
+    jobs = {job.name: job for job in scheduler.build_jobs({
+        "SCHEDULE_BOUNCES_SECONDS": 300, "SCHEDULE_RETRY_SECONDS": 1800,
+        "SCHEDULE_SUMMARY_AT": "00:00", "SCHEDULE_RETENTION_AT": "03:00"})}
+
+    env.write_text("IMAP_TEST_MODE=false\nNOTIFY_CC=ops@example.com\nNOTIFY_CC_TEST=dev@example.com\n"
+                   "SMTP_SERVER=relay-a\n")
+    jobs["summary"].func(FakeConnections())
+
+    # Dashboard toggle and an SMTP edit, without restarting the scheduler
+    env.write_text("IMAP_TEST_MODE=true\nNOTIFY_CC=ops@example.com\nNOTIFY_CC_TEST=dev@example.com\n"
+                   "SMTP_SERVER=relay-b\n")
+    jobs["summary"].func(FakeConnections())
+    jobs["retry"].func(FakeConnections())
+
+    assert sent == [("relay-a", ["ops@example.com"]),
+                    ("relay-b", ["dev@example.com"]),
+                    ("relay-b", ["u@x.com"])]
@@ -0,0 +1,65 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import db
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client(tmp_db, monkeypatch):
+    # webui mounts docs/ and reads data/.env relative to the repo root
+    monkeypatch.chdir(REPO_ROOT)
+    from fastapi.testclient import TestClient
+    import webui
+    monkeypatch.setattr(webui, "ADMIN_PASS", "secret")
+
+    for i in range(3):
+        db.insert_bounce(f"u{i}@x.com", "", "failed", "550, user unknown", "x.com", account="billing")
+    db.insert_bounce("v@y.com", "", "unknown", "", "y.com", account="support")
+
+    client = TestClient(webui.app)
+    client.post("/login", data={"password": "secret"}, follow_redirects=False)
+    return client
+
+
+def test_export_csv_has_header_and_filtered_rows(client):
+    response = client.get("/api/export", params={"format": "csv", "account": "billing"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="bounces-' in response.headers["content-disposition"]
+
+    lines = response.text.splitlines()
+    assert lines[0] == ",".join(db.BOUNCE_COLUMNS)
+    assert len(lines) == 4
+    assert '"550, user unknown"' in lines[1]
+
+
+def test_export_ndjson_gzip_is_one_object_per_line(client, monkeypatch):
+    import webui
+    monkeypatch.setattr(webui, "EXPORT_CHUNK_ROWS", 3)  # spans several chunks
+
+    response = client.get("/api/export", params={"format": "ndjson", "gzip": "true"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+
+    body = gzip.decompress(response.content).decode("utf-8")
+    assert body.endswith("\n")
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row["id"] for row in rows] == [1, 2, 3, 4]
+    assert list(rows[0]) == db.BOUNCE_COLUMNS
+
+
+def test_export_rejects_unknown_format(client):
+    assert client.get("/api/export", params={"format": "xlsx"}).status_code == 400
+
+
+def test_domain_stats_is_one_snapshot_with_watermark(client):
+    stats = client.get("/api/domain_stats", params={"recent": 2}).json()
+    assert stats["last_id"] == 4
+    assert stats["total"] == 4 == sum(row["count"] for row in stats["data"])
+    assert [row["id"] for row in stats["recent"]] == [4, 3]
+    assert {row["domain"]: row["count"] for row in stats["data"]} == {"x.com": 3, "y.com": 1}
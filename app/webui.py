@@ -1,12 +1,19 @@
+import io
 import os
+import csv
+import json
+import zlib
 import subprocess
+from datetime import datetime, timezone
 from fastapi import FastAPI, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from dotenv import load_dotenv, set_key
-from db import query_bounces, count_bounces
+from db import (query_bounces, count_bounces, iter_bounces, latest_bounces, dashboard_snapshot,
+                BOUNCE_COLUMNS)
+from live_feed import LiveFeed, counter_deltas
 
 # ============================================
 # Load environment and validate
@@ -87,17 +94,118 @@ async def api_logs(request: Request):
         return RedirectResponse(url="/login")
 
     params = dict(request.query_params)
-    rows = query_bounces(params)
+    limit = params.pop("limit", "")
+    if limit.isdigit():
+        # Newest rows only (dashboard initial load); the live feed adds the rest
+        rows = latest_bounces(params, int(limit))
+    else:
+        rows = query_bounces(params)
     return {"data": rows, "recordsTotal": len(rows), "recordsFiltered": len(rows)}
 
 
 @app.get("/api/domain_stats", response_class=JSONResponse)
-async def api_domain_stats(request: Request):
+async def api_domain_stats(request: Request, recent: int = 0):
+    """Domain counts plus the total, the `recent` newest rows and the
+    last_id watermark, all from one snapshot (start /api/live there)"""
     if "user" not in request.session:
         return RedirectResponse(url="/login")
 
-    rows = query_bounces({"group_by": "domain"})
-    return {"data": rows}
+    snapshot = dashboard_snapshot(max(recent, 0))
+    return {"data": snapshot["domains"], "total": snapshot["total"],
+            "recent": snapshot["recent"], "last_id": snapshot["last_id"]}
+
+
+# ============================================
+# Live feed (Server-Sent Events)
+# ============================================
+
+live_feed = LiveFeed()
+
+
+async def live_events(request, since):
+    async for rows in live_feed.subscribe(since):
+        if await request.is_disconnected():
+            break
+        if not rows:
+            yield ": keep-alive\n\n"
+            continue
+        payload = {"rows": rows, **counter_deltas(rows)}
+        # id lets EventSource resume from Last-Event-ID after a reconnect
+        yield f"id: {rows[-1]['id']}\nevent: bounces\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.get("/api/live")
+async def api_live(request: Request, since: int | None = None):
+    """New bounces with id > since, plus domain/status count deltas"""
+    if "user" not in request.session:
+        return RedirectResponse(url="/login")
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        live_events(request, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ============================================
+# Streaming export
+# ============================================
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FILTERS = ("status", "domain", "account", "date_from", "date_to")
+
+
+def export_stream(filters, fmt, compress):
+    """Generator of encoded export chunks (CSV or NDJSON, optionally gzip).
+
+    Sync on purpose: StreamingResponse runs it in the thread pool, so the
+    SQLite reads never block the event loop.
+    """
+    gzipper = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip container
+
+    def emit(text):
+        data = text.encode("utf-8")
+        return gzipper.compress(data) if gzipper else data
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(BOUNCE_COLUMNS)
+        yield emit(buffer.getvalue())
+
+    for rows in iter_bounces(filters, EXPORT_CHUNK_ROWS):
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([row.get(col) for col in BOUNCE_COLUMNS] for row in rows)
+            chunk = emit(buffer.getvalue())
+        else:
+            chunk = emit("".join(json.dumps(row) + "\n" for row in rows))
+        if chunk:
+            yield chunk
+
+    if gzipper:
+        yield gzipper.flush()
+
+
+@app.get("/api/export")
+async def api_export(request: Request, format: str = "csv", gzip: bool = False):
+    if "user" not in request.session:
+        return RedirectResponse(url="/login")
+    if format not in ("csv", "ndjson"):
+        return JSONResponse({"error": "format must be csv or ndjson"}, status_code=400)
+
+    filters = {k: v for k, v in request.query_params.items() if k in EXPORT_FILTERS and v}
+    filename = f"bounces-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        export_stream(filters, format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @app.get("/logout")
@@ -134,7 +242,7 @@ async def run_bounce_check_page(request: Request):
 async def run_bounce_check_stream(request: Request):
     if "user" not in request.session:
         return RedirectResponse(url="/login")
-    return StreamingResponse(stream_process(["python", "/app/process_bounces.py"]), media_type="text/event-stream")
+    return StreamingResponse(stream_process(["python", "/app/dispatch.py", "bounces", "--force"]), media_type="text/event-stream")
 
 @app.get("/run_retry_queue", response_class=HTMLResponse)
 async def run_retry_queue_page(request: Request):
@@ -146,7 +254,7 @@ async def run_retry_queue_page(request: Request):
 async def run_retry_queue_stream(request: Request):
     if "user" not in request.session:
         return RedirectResponse(url="/login")
-    return StreamingResponse(stream_process(["python", "/app/retry_queue.py"]), media_type="text/event-stream")
+    return StreamingResponse(stream_process(["python", "/app/dispatch.py", "retry", "--force"]), media_type="text/event-stream")
 
 # ============================================
 # Toggle endpoints